@@ -0,0 +1,115 @@
+import asyncio
+import weakref
+
+import config
+
+
+class BufferReader:
+    """Cursor of one consumer over an :class:`AudioBuffer`.
+
+    Yields the stored chunks as ``memoryview`` objects (no copies), waiting
+    for new ones until the buffer is closed. A reader that is closed or
+    dropped no longer holds the writer back.
+    """
+
+    def __init__(self, buffer: "AudioBuffer") -> None:
+        self.buffer = buffer
+        self.index = 0
+        self.pos = 0
+        buffer._readers.add(self)
+
+    def __aiter__(self) -> "BufferReader":
+        return self
+
+    async def __anext__(self) -> memoryview:
+        buf = self.buffer
+        while self.index >= len(buf._chunks):
+            if buf.closed:
+                self.close()
+                if buf.error is not None:
+                    raise buf.error
+                raise StopAsyncIteration
+            await buf._wait()
+        chunk = buf._chunks[self.index]
+        self.index += 1
+        self.pos += len(chunk)
+        buf._notify()
+        return memoryview(chunk)
+
+    def close(self) -> None:
+        self.buffer._readers.discard(self)
+        self.buffer._notify()
+
+    async def aclose(self) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # Wake a writer that may be waiting for this reader to catch up
+        try:
+            self.buffer._notify()
+        except Exception:
+            pass
+
+
+class AudioBuffer:
+    """Append-only audio shared by several consumers without copying.
+
+    The writer (a TTS stream) appends chunks; every :meth:`reader` walks
+    the same chunk list at its own pace, so the player, the lip-sync
+    analyzer and any other consumer see one copy of the audio. Readers
+    created late still get the data from the start.
+
+    When an attached reader falls more than ``max_lag`` bytes behind,
+    :meth:`append` waits for it, which in turn slows down the download.
+    With no readers attached appends never wait (e.g. segments prefetched
+    ahead of playback). Chunks must not be modified after being appended.
+    """
+
+    def __init__(self, max_lag: int | None = config.AUDIO_BUFFER_MAX_LAG) -> None:
+        self.max_lag = max_lag
+        self.size = 0
+        self.closed = False
+        self.error: BaseException | None = None
+        self._chunks: list[bytes] = []
+        self._readers: weakref.WeakSet[BufferReader] = weakref.WeakSet()
+        self._event = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def _wait(self) -> None:
+        await self._event.wait()
+
+    def _lag(self) -> int:
+        readers = list(self._readers)
+        if not readers:
+            return 0
+        return self.size - min(r.pos for r in readers)
+
+    async def append(self, chunk: bytes) -> None:
+        if self.closed:
+            raise RuntimeError("AudioBuffer is closed")
+        if not chunk:
+            return
+        if self.max_lag is not None:
+            while self._lag() > self.max_lag:
+                await self._wait()
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        self._notify()
+
+    async def wait_ready(self) -> None:
+        """Wait for the first chunk (or the end of an empty stream)."""
+        while not self._chunks and not self.closed:
+            await self._wait()
+
+    def close(self, error: BaseException | None = None) -> None:
+        """End the stream; readers raise ``error`` once they reach the end."""
+        if not self.closed:
+            self.closed = True
+            self.error = error
+            self._notify()
+
+    def reader(self) -> BufferReader:
+        return BufferReader(self)
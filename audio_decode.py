@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import subprocess
+from typing import AsyncIterator
+
+FFMPEG_PATH = os.path.join("ffmpeg", "bin", "ffmpeg.exe")
+
+# Output format of the decoder: mono signed 16-bit little-endian PCM.
+SAMPLE_RATE = 48000
+
+# The API's "pcm" response format: raw s16le mono at 24 kHz, no header
+PCM_SAMPLE_RATE = 24000
+# Formats that are already PCM and need no decoder process
+RAW_FORMATS = ("pcm", "wav")
+
+
+def input_args(fmt: str) -> list[str]:
+    """ffmpeg/ffplay options describing a TTS response format on stdin."""
+    if fmt == "pcm":
+        return ["-f", "s16le", "-ar", str(PCM_SAMPLE_RATE), "-ac", "1"]
+    # "opus" responses are Ogg files
+    return ["-f", {"opus": "ogg"}.get(fmt, fmt)]
+
+
+def decoded_rate(fmt: str) -> int:
+    """Sample rate of the PCM produced by :func:`open_decoder` for ``fmt``."""
+    return PCM_SAMPLE_RATE if fmt in RAW_FORMATS else SAMPLE_RATE
+
+
+class PCMDecoder:
+    """Long-lived ffmpeg process decoding a compressed stream to PCM.
+
+    Compressed bytes are written to stdin with :meth:`feed` as they arrive
+    and decoded PCM is read back through :meth:`__aiter__`. One process
+    handles a whole utterance, so MP3 frames split across network chunks
+    are reassembled by the decoder instead of being lost.
+
+    Reading must happen concurrently with feeding, otherwise ffmpeg blocks
+    on a full stdout pipe.
+    """
+
+    def __init__(
+        self,
+        fmt: str = "mp3",
+        sample_rate: int = SAMPLE_RATE,
+        read_size: int = 8192,
+    ) -> None:
+        self.fmt = fmt
+        self.sample_rate = sample_rate
+        self.read_size = read_size
+        self._proc: asyncio.subprocess.Process | None = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        async with self._start_lock:
+            if self._proc is None:
+                await self._spawn()
+
+    async def _spawn(self) -> None:
+        self._proc = await asyncio.create_subprocess_exec(
+            FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+            *input_args(self.fmt), "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", str(self.sample_rate), "pipe:1",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    async def feed(self, data: bytes) -> None:
+        """Write compressed bytes to the decoder."""
+        if self._proc is None:
+            await self.start()
+        try:
+            self._proc.stdin.write(data)
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logging.warning("ffmpeg decoder pipe closed: %s", e)
+
+    async def finish(self) -> None:
+        """Signal end of input; the reader stops after the last PCM block."""
+        if self._proc is None or self._proc.stdin.is_closing():
+            return
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._proc is None:
+            await self.start()
+        while chunk := await self._proc.stdout.read(self.read_size):
+            yield chunk
+
+    async def close(self) -> None:
+        if self._proc is None:
+            return
+        if self._proc.returncode is None:
+            await self.finish()
+            try:
+                await asyncio.wait_for(self._proc.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                self._proc.kill()
+                await self._proc.wait()
+        self._proc = None
+
+
+class RawPCMDecoder:
+    """Stand-in for :class:`PCMDecoder` when the audio already is PCM.
+
+    ``pcm`` chunks are passed through as they are and ``wav`` chunks after
+    the header, without copying and without an ffmpeg process. Mono 16-bit
+    audio is expected, as returned by the API.
+    """
+
+    def __init__(self, fmt: str = "pcm", sample_rate: int = PCM_SAMPLE_RATE) -> None:
+        self.fmt = fmt
+        self.sample_rate = sample_rate
+        self._queue: asyncio.Queue[bytes | memoryview | None] = asyncio.Queue()
+        self._header: bytearray | None = bytearray() if fmt == "wav" else None
+        self._finished = False
+
+    async def start(self) -> None:
+        pass
+
+    def _skip_header(self, data: bytes | memoryview) -> bytes | None:
+        """Collect the WAV header; return the audio after it once complete."""
+        self._header += data
+        head = self._header
+        pos = 12
+        while pos + 8 <= len(head):
+            kind = bytes(head[pos : pos + 4])
+            size = int.from_bytes(head[pos + 4 : pos + 8], "little")
+            if kind == b"fmt " and pos + 16 <= len(head):
+                self.sample_rate = int.from_bytes(head[pos + 12 : pos + 16], "little")
+            if kind == b"data":
+                self._header = None
+                return bytes(head[pos + 8 :])
+            pos += 8 + size
+        return None
+
+    async def feed(self, data: bytes | memoryview) -> None:
+        if self._header is not None:
+            data = self._skip_header(data)
+            if not data:
+                return
+        self._queue.put_nowait(data)
+
+    async def finish(self) -> None:
+        if not self._finished:
+            self._finished = True
+            self._queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[bytes | memoryview]:
+        while (chunk := await self._queue.get()) is not None:
+            yield chunk
+
+    async def close(self) -> None:
+        await self.finish()
+
+
+def open_decoder(fmt: str) -> PCMDecoder | RawPCMDecoder:
+    """Return a decoder to s16le mono PCM for audio in ``fmt``."""
+    if fmt in RAW_FORMATS:
+        return RawPCMDecoder(fmt)
+    return PCMDecoder(fmt)
+
+
+async def decode_pcm(audio: bytes, fmt: str = "mp3") -> bytes:
+    """Decode a complete audio file to s16le mono PCM (see :func:`decoded_rate`)."""
+    decoder = open_decoder(fmt)
+    await decoder.start()
+
+    async def write() -> None:
+        await decoder.feed(audio)
+        await decoder.finish()
+
+    writer = asyncio.create_task(write())
+    pcm = bytearray()
+    try:
+        async for block in decoder:
+            pcm += block
+        await writer
+    finally:
+        writer.cancel()
+        await decoder.close()
+    return bytes(pcm[: len(pcm) // 2 * 2])
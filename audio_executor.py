@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+
+import numpy as np
+
+import config
+
+MODES = ("process", "thread", "inline")
+
+
+def frame_count(samples: int, sample_rate: int, frame_ms: int) -> int:
+    """Frames of ``frame_ms`` in ``samples``, a trailing partial one included."""
+    hop = max(1, sample_rate * frame_ms // 1000)
+    return -(-samples // hop)
+
+
+def _shared_job(
+    fn: Callable[..., np.ndarray],
+    src_name: str,
+    samples: int,
+    dst_name: str,
+    shape: tuple[int, ...],
+    args: tuple,
+) -> None:
+    """Run ``fn`` in a worker process on PCM in shared memory.
+
+    The result is written into the caller's output block, so neither the
+    audio nor the frames are pickled.
+    """
+    src = SharedMemory(src_name)
+    dst = SharedMemory(dst_name)
+    try:
+        pcm = np.ndarray((samples,), np.int16, src.buf)
+        out = np.ndarray(shape, np.float32, dst.buf)
+        out[...] = fn(pcm, *args)
+        # Views must be gone before the blocks can be closed
+        del pcm, out
+    finally:
+        src.close()
+        dst.close()
+
+
+class AudioExecutor:
+    """Runs CPU-bound audio work away from the event loop.
+
+    ``mode`` is one of :data:`MODES`:
+
+    - ``process``: whole clips (:meth:`frames`) are analysed in a pool of
+      worker processes; the PCM and the resulting frames are exchanged
+      through shared memory blocks. Streaming work (:meth:`run`) keeps
+      state between chunks and goes to a thread pool; NumPy releases the
+      GIL for the heavy parts.
+    - ``thread``: everything goes to the thread pool.
+    - ``inline``: everything runs on the event loop, as before.
+
+    Pools are started on first use.
+    """
+
+    def __init__(
+        self, mode: str = config.AUDIO_EXECUTOR, workers: int = config.AUDIO_WORKERS
+    ) -> None:
+        self.configure(mode, workers)
+        self._threads: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+
+    def configure(self, mode: str, workers: int | None = None) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown executor mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        if workers is not None:
+            self.workers = max(1, workers)
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix="audio")
+        return self._threads
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # Forking a process with running threads is unsafe; spawn is
+            # also what Windows uses
+            self._processes = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            logging.debug("Started %d audio worker processes", self.workers)
+        return self._processes
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Call ``fn(*args)`` in the thread pool (on the loop in ``inline`` mode)."""
+        if self.mode == "inline":
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread_pool(), partial(fn, *args))
+
+    async def frames(
+        self,
+        fn: Callable[..., np.ndarray],
+        pcm: bytes | bytearray | memoryview,
+        sample_rate: int,
+        frame_ms: int = config.LIPSYNC_FRAME_MS,
+        *args: Any,
+        columns: int = 1,
+    ) -> np.ndarray:
+        """Per-frame analysis of a complete clip of s16le mono PCM.
+
+        ``fn(pcm, sample_rate, frame_ms, *args)`` must be a module-level
+        function returning one float row (or value, with ``columns=1``) per
+        started ``frame_ms`` frame, e.g. :func:`lipsync.rms_envelope`.
+        """
+        if self.mode != "process":
+            samples = np.frombuffer(pcm, np.int16, len(pcm) // 2)
+            return await self.run(fn, samples, sample_rate, frame_ms, *args)
+        samples = len(pcm) // 2
+        rows = frame_count(samples, sample_rate, frame_ms)
+        shape = (rows,) if columns == 1 else (rows, columns)
+        src = SharedMemory(create=True, size=max(1, samples * 2))
+        dst = SharedMemory(create=True, size=max(1, rows * columns * 4))
+        try:
+            src.buf[: samples * 2] = memoryview(pcm).cast("B")[: samples * 2]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self._process_pool(),
+                _shared_job,
+                fn, src.name, samples, dst.name, shape,
+                (sample_rate, frame_ms, *args),
+            )
+            # Frames are about 1/500 of the PCM; copied out so the block
+            # can be released right away
+            result = np.ndarray(shape, np.float32, dst.buf).copy()
+        finally:
+            for block in (src, dst):
+                block.close()
+                block.unlink()
+        return result
+
+    def close(self) -> None:
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
+
+
+executor = AudioExecutor()
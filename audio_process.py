@@ -0,0 +1,159 @@
+import numpy as np
+
+import config
+from audio_decode import PCM_SAMPLE_RATE
+
+
+def db_to_amplitude(db: float) -> float:
+    return 10 ** (db / 20)
+
+
+class RunningLoudness:
+    """Running mean square of voiced audio.
+
+    Shared by the segments of one reply so that each sentence is brought
+    to the same level as the ones before it.
+    """
+
+    def __init__(self, window: float = config.LOUDNESS_WINDOW) -> None:
+        self.window = window
+        self.mean_square: float | None = None
+
+    def update(self, power: np.ndarray, frame: float) -> float | None:
+        """Fold in the mean squares of voiced ``frame``-second frames."""
+        if len(power):
+            block = float(power.mean())
+            if self.mean_square is None:
+                self.mean_square = block
+            else:
+                # Same as an exponential average frame by frame
+                alpha = 1 - (1 - min(1.0, frame / self.window)) ** len(power)
+                self.mean_square += alpha * (block - self.mean_square)
+        return self.mean_square
+
+
+class AudioProcessor:
+    """Trim silence and even out the loudness of streamed s16le mono PCM.
+
+    :meth:`process` takes chunks as they arrive from the TTS API and
+    returns the audio to play. Everything before the first frame louder
+    than ``threshold_db`` is dropped except a ``pad_ms`` pre-roll, so
+    playback starts with the voice. Quiet frames after the voice are held
+    back until more voice follows; :meth:`flush` cuts what is still held
+    at the end down to ``pad_ms``.
+
+    The gain moves the running loudness towards ``target_db`` (within
+    ``max_gain_db`` either way) and is ramped between blocks, so the level
+    heard by the viewer and seen by lip sync is the same for every voice
+    and sentence.
+
+    Voiced audio is passed on with less than one frame of delay. A pause
+    is held back in full until the voice resumes (or :meth:`flush` is
+    called), so the output lags the input by up to the length of the
+    current pause.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = PCM_SAMPLE_RATE,
+        frame_ms: int = config.LIPSYNC_FRAME_MS,
+        threshold_db: float = config.SILENCE_THRESHOLD_DB,
+        pad_ms: int = config.SILENCE_PAD_MS,
+        target_db: float = config.LOUDNESS_TARGET_DB,
+        max_gain_db: float = config.LOUDNESS_MAX_GAIN_DB,
+        loudness: RunningLoudness | None = None,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.hop = max(1, sample_rate * frame_ms // 1000)
+        self.frame = self.hop / sample_rate
+        self.threshold = db_to_amplitude(threshold_db) ** 2
+        self.pad = sample_rate * pad_ms // 1000
+        self.target = db_to_amplitude(target_db)
+        self.max_gain = db_to_amplitude(max_gain_db)
+        self.loudness = loudness or RunningLoudness()
+        self.started = False
+        # Samples removed as silence
+        self.trimmed = 0
+        self._partial = bytearray()
+        self._held = np.zeros(0, np.int16)
+        self._gain: float | None = None
+        self._next_gain = 1.0
+
+    def process(self, chunk: bytes | bytearray | memoryview) -> bytes:
+        """Return the processed audio that can be played so far."""
+        self._partial += chunk
+        usable = len(self._partial) // (2 * self.hop) * 2 * self.hop
+        if not usable:
+            return b""
+        sig = np.frombuffer(bytes(self._partial[:usable]), np.int16)
+        del self._partial[:usable]
+        return self._run(sig)
+
+    def flush(self) -> bytes:
+        """Return the rest of the utterance with trailing silence cut."""
+        usable = len(self._partial) // 2 * 2
+        tail = np.frombuffer(bytes(self._partial[:usable]), np.int16)
+        self._partial.clear()
+        if len(tail) and self._power(tail).max() > self.threshold:
+            # A short voiced end that did not fill a frame
+            self.started = True
+            out = np.concatenate((self._held, tail))
+        else:
+            held = np.concatenate((self._held, tail))
+            out = held[: self.pad] if self.started else held[:0]
+            self.trimmed += len(held) - len(out)
+        self._held = np.zeros(0, np.int16)
+        return self._apply(out)
+
+    def _power(self, sig: np.ndarray) -> np.ndarray:
+        """Mean square of every frame (a partial frame counts as one)."""
+        frames = sig.astype(np.float32) / 32768
+        if len(frames) % self.hop:
+            return np.array([np.mean(frames * frames)], np.float32)
+        frames = frames.reshape(-1, self.hop)
+        return np.mean(frames * frames, axis=1)
+
+    def _run(self, sig: np.ndarray) -> bytes:
+        power = self._power(sig)
+        voiced = np.flatnonzero(power > self.threshold)
+        mean_square = self.loudness.update(power[voiced], self.frame)
+        if mean_square:
+            gain = self.target / np.sqrt(mean_square)
+            self._next_gain = float(np.clip(gain, 1 / self.max_gain, self.max_gain))
+        if not len(voiced):
+            held = np.concatenate((self._held, sig))
+            if not self.started:
+                # Only the pre-roll before the first voiced frame is kept
+                keep = held[max(0, len(held) - self.pad) :]
+                self.trimmed += len(held) - len(keep)
+                held = keep
+            self._held = held
+            return b""
+        first, last = voiced[0] * self.hop, (voiced[-1] + 1) * self.hop
+        if self.started:
+            out = np.concatenate((self._held, sig[:last]))
+        else:
+            self.started = True
+            head = np.concatenate((self._held, sig[:first]))
+            pre = head[max(0, len(head) - self.pad) :]
+            self.trimmed += len(head) - len(pre)
+            out = np.concatenate((pre, sig[first:last]))
+        self._held = sig[last:]
+        return self._apply(out)
+
+    def _apply(self, sig: np.ndarray) -> bytes:
+        if not len(sig):
+            return b""
+        start = self._next_gain if self._gain is None else self._gain
+        end = self._gain = self._next_gain
+        if start == end:
+            out = sig * np.float32(end)
+        else:
+            out = sig * np.linspace(start, end, len(sig), dtype=np.float32)
+        return np.clip(out, -32768, 32767).astype(np.int16).tobytes()
+
+
+def process_clip(audio: bytes, **kwargs) -> bytes:
+    """Trim and normalize a complete PCM clip."""
+    processor = AudioProcessor(**kwargs)
+    return processor.process(audio) + processor.flush()
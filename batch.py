@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+
+import numpy as np
+from dotenv import load_dotenv
+
+import config
+from chat_client import ChatClient
+from audio_decode import PCM_SAMPLE_RATE, decode_pcm, decoded_rate
+from audio_executor import MODES, executor
+from lipsync import rms_envelope
+from telemetry import telemetry
+from tts_cache import TTSCache, normalize_text
+from visemes import analyze_pcm
+
+
+@dataclass
+class BatchItem:
+    """One line of a script: literal text to speak or a prompt to answer."""
+
+    index: int
+    text: str
+    voice: str
+    prompt: bool = False
+    id: str = ""
+
+
+def item_id(
+    text: str, voice: str, fmt: str, prompt: bool, model: str = config.VOICE_MODEL
+) -> str:
+    """Stable id of a rendered line, so reordering the script keeps it.
+
+    ``model`` is the TTS model of the provider the line is rendered with.
+    """
+    raw = "\0".join(
+        ("prompt" if prompt else "line", normalize_text(text), voice, model, fmt)
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def load_items(
+    path: str,
+    voice: str,
+    fmt: str,
+    prompts: bool = False,
+    model: str = config.VOICE_MODEL,
+) -> list[BatchItem]:
+    """Read a script.
+
+    ``.jsonl`` files hold one object per line with ``text`` (spoken as is)
+    or ``prompt`` (answered by the model first) and optional ``voice`` and
+    ``id``. Other files are read line by line; blank lines and lines
+    starting with ``#`` are skipped, and ``prompts`` decides how the lines
+    are used.
+    """
+    items: list[BatchItem] = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+                is_prompt = "prompt" in entry
+                text = entry["prompt"] if is_prompt else entry["text"]
+                item = BatchItem(n, text, entry.get("voice", voice), is_prompt,
+                                 str(entry.get("id", "")))
+            else:
+                item = BatchItem(n, line, voice, prompts)
+            if not item.id:
+                item.id = item_id(item.text, item.voice, fmt, item.prompt, model)
+            items.append(item)
+    return items
+
+
+class BatchRenderer:
+    """Render script lines to audio files with a bounded number of workers.
+
+    Each finished line is appended to ``manifest.jsonl`` in ``out_dir``
+    together with its audio file and, if enabled, its lip-sync envelope
+    (``<id>.npy``, float32 RMS per ``LIPSYNC_FRAME_MS`` frame) and viseme
+    frames (``<id>.visemes.npy``, see :class:`VisemeEngine`). Lines that
+    are already in the manifest with their audio on disk are skipped, so an
+    interrupted run resumes where it stopped. Requests go through the
+    client's rate limiters and retry logic.
+    """
+
+    def __init__(
+        self,
+        client: ChatClient,
+        out_dir: str = config.BATCH_OUTPUT_DIR,
+        fmt: str = config.BATCH_FORMAT,
+        workers: int = config.BATCH_WORKERS,
+        envelopes: bool = True,
+        visemes: bool = False,
+        system_prompt: str | None = config.SYSTEM_PROMPT,
+    ) -> None:
+        self.client = client
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.workers = max(1, workers)
+        self.envelopes = envelopes
+        self.visemes = visemes
+        self.system_prompt = system_prompt
+        self.manifest_path = os.path.join(out_dir, "manifest.jsonl")
+        os.makedirs(out_dir, exist_ok=True)
+        self.done = self._load_manifest()
+        self.rendered = 0
+        self.failed = 0
+
+    def _load_manifest(self) -> dict[str, dict]:
+        done: dict[str, dict] = {}
+        if not os.path.exists(self.manifest_path):
+            return done
+        with open(self.manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line of a run that was killed mid-write
+                    continue
+                if os.path.exists(os.path.join(self.out_dir, entry["audio"])):
+                    done[entry["id"]] = entry
+        return done
+
+    def _record(self, entry: dict) -> None:
+        self.done[entry["id"]] = entry
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    async def _render(self, item: BatchItem) -> dict:
+        start = time.monotonic()
+        text = item.text
+        if item.prompt:
+            # Every prompt is answered on its own, without shared history
+            session = self.client.fork(self.system_prompt)
+            try:
+                text = await session.ask(item.text)
+            finally:
+                await session.close()
+
+        name = f"{item.id}.{self.fmt}"
+        path = os.path.join(self.out_dir, name)
+        tmp = f"{path}.tmp"
+        try:
+            stream = await self.client.tts(text, voice=item.voice, fmt=self.fmt)
+            async with aclosing(stream):
+                with open(tmp, "wb") as f:
+                    async for chunk in stream:
+                        f.write(chunk)
+            entry = {
+                "id": item.id,
+                "index": item.index,
+                "input": item.text,
+                "text": text,
+                "voice": item.voice,
+                "format": self.fmt,
+                "audio": name,
+                "bytes": os.path.getsize(tmp),
+            }
+            if self.fmt == "pcm":
+                # Raw s16le mono samples carry no header
+                entry["rate"] = PCM_SAMPLE_RATE
+            if self.envelopes:
+                entry.update(await self._envelope(item.id, tmp))
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        entry["elapsed"] = round(time.monotonic() - start, 3)
+        return entry
+
+    async def _envelope(self, item_id: str, audio_path: str) -> dict:
+        with open(audio_path, "rb") as f:
+            audio = f.read()
+        try:
+            pcm = await decode_pcm(audio, self.fmt)
+        except FileNotFoundError:
+            logging.warning("ffmpeg not found, lip-sync envelopes disabled")
+            self.envelopes = False
+            return {}
+        rate = decoded_rate(self.fmt)
+        levels = await executor.frames(rms_envelope, pcm, rate)
+        name = f"{item_id}.npy"
+        np.save(os.path.join(self.out_dir, name), levels)
+        entry = {
+            "envelope": name,
+            "frame_ms": config.LIPSYNC_FRAME_MS,
+            "duration": round(len(levels) * config.LIPSYNC_FRAME_MS / 1000, 3),
+        }
+        if self.visemes:
+            entry["visemes"] = f"{item_id}.visemes.npy"
+            frames = await executor.frames(analyze_pcm, pcm, rate, columns=2)
+            np.save(os.path.join(self.out_dir, entry["visemes"]), frames)
+        return entry
+
+    async def _worker(self, queue: asyncio.Queue, total: int) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            turn = telemetry.begin_turn("batch")
+            try:
+                entry = await self._render(item)
+            except Exception as e:
+                self.failed += 1
+                logging.error("Line %d failed: %s", item.index + 1, e)
+                continue
+            finally:
+                telemetry.end_turn(turn)
+            self._record(entry)
+            self.rendered += 1
+            logging.info(
+                "[%d/%d] line %d -> %s (%.1fs)",
+                self.rendered, total, item.index + 1, entry["audio"], entry["elapsed"],
+            )
+
+    async def run(self, items: list[BatchItem]) -> None:
+        todo = [item for item in items if item.id not in self.done]
+        skipped = len(items) - len(todo)
+        if skipped:
+            logging.info("Skipping %d already rendered lines", skipped)
+        queue: asyncio.Queue[BatchItem | None] = asyncio.Queue()
+        for item in todo:
+            queue.put_nowait(item)
+        workers = min(self.workers, len(todo))
+        for _ in range(workers):
+            queue.put_nowait(None)
+        start = time.monotonic()
+        await asyncio.gather(*(self._worker(queue, len(todo)) for _ in range(workers)))
+        logging.info(
+            "Rendered %d, skipped %d, failed %d in %.1fs",
+            self.rendered, skipped, self.failed, time.monotonic() - start,
+        )
+
+
+async def run() -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Pre-render scripted lines to audio files"
+    )
+    parser.add_argument("script", help="text file (one line each) or .jsonl")
+    parser.add_argument("--out", default=config.BATCH_OUTPUT_DIR, help="output directory")
+    parser.add_argument(
+        "--prompts",
+        action="store_true",
+        help="treat lines of a text file as prompts and speak the model's answers",
+    )
+    parser.add_argument("--workers", type=int, default=config.BATCH_WORKERS)
+    parser.add_argument(
+        "--format",
+        default=config.BATCH_FORMAT,
+        help="audio format (pcm files are headerless, see the manifest's rate)",
+    )
+    parser.add_argument("--voice", default=config.DEFAULT_VOICE, help="TTS voice")
+    parser.add_argument("--system", default=config.SYSTEM_PROMPT, help="system prompt")
+    parser.add_argument(
+        "--envelopes",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="precompute lip-sync envelopes (needs ffmpeg)",
+    )
+    parser.add_argument(
+        "--visemes",
+        action=argparse.BooleanOptionalAction,
+        default=config.VISEMES,
+        help="also store viseme parameter frames",
+    )
+    parser.add_argument(
+        "--tts-cache",
+        action=argparse.BooleanOptionalAction,
+        default=config.ENABLE_TTS_CACHE,
+        help="also store the audio in the TTS cache for live replies",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=MODES,
+        default=config.AUDIO_EXECUTOR,
+        help="where envelopes and visemes are computed",
+    )
+    parser.add_argument("--token", help="OpenAI API key")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    executor.configure(args.executor)
+    try:
+        client = ChatClient(
+            api_key=args.token,
+            debug=args.debug,
+            system_prompt=args.system,
+            tts_cache=TTSCache() if args.tts_cache else None,
+        )
+        model = client.router.pick("speech").provider.voice_model
+    except RuntimeError as e:
+        print(e)
+        return 1
+    try:
+        items = load_items(args.script, args.voice, args.format, args.prompts, model)
+        renderer = BatchRenderer(
+            client,
+            out_dir=args.out,
+            fmt=args.format,
+            workers=args.workers,
+            envelopes=args.envelopes,
+            visemes=args.visemes,
+            system_prompt=args.system,
+        )
+        await renderer.run(items)
+    finally:
+        await client.close()
+        executor.close()
+    return 1 if renderer.failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(run()))
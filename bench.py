@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import AsyncIterator
+
+import numpy as np
+
+import audio_decode
+import config
+import main as cli
+import player
+from chat_client import ChatClient
+from routing import Provider
+from lipsync import LipSync
+from mock_servers import MockOpenAI, MockVTS
+from text_segment import segment_stream
+from tts_scheduler import TTSScheduler
+from vtube import VTubeClient
+from vtube_stream import VTubeStreamer
+from vts_connection import VTSConnection
+
+# Stand-ins for ffplay/ffmpeg: the mock TTS returns raw PCM, so the
+# "decoder" passes stdin through and the "player" discards it. This measures
+# the pipeline itself, not the codec.
+_PASSTHROUGH = """import shutil, sys
+shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer, 8192)
+"""
+_NULL_SINK = """import sys
+while sys.stdin.buffer.read(65536):
+    pass
+"""
+
+# Imported by main.run() only when needed; importing main must not load them
+LAZY_MODULES = ("numpy", "httpx", "websockets", "dotenv", "audio_executor")
+
+
+def _install_stand_ins(tmpdir: str) -> None:
+    def script(name: str, code: str) -> str:
+        path = os.path.join(tmpdir, f"{name}.py")
+        with open(path, "w") as f:
+            f.write(f"#!{sys.executable}\n{code}")
+        if os.name == "nt":
+            wrapper = os.path.join(tmpdir, f"{name}.cmd")
+            with open(wrapper, "w") as f:
+                f.write(f'@"{sys.executable}" "{path}" %*\n')
+            return wrapper
+        os.chmod(path, 0o755)
+        return path
+
+    audio_decode.FFMPEG_PATH = script("decoder", _PASSTHROUGH)
+    player.FFPLAY_PATH = script("player", _NULL_SINK)
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    arr = np.asarray(values)
+    return {
+        "mean": float(arr.mean()),
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "max": float(arr.max()),
+    }
+
+
+class TurnTimer:
+    """Wrap a client (and player) to timestamp the first token, first audio
+    byte and first chunk handed to the player."""
+
+    def __init__(self, client: ChatClient, audio_player: player.AudioPlayer | None = None) -> None:
+        self.client = client
+        self.first_token: float | None = None
+        self.first_audio: float | None = None
+        self.first_play: float | None = None
+        self._tts = client.tts
+        client.tts = self._timed_tts
+        if audio_player is not None:
+            self._play = audio_player.play
+            audio_player.play = self._timed_play
+
+    def reset(self) -> None:
+        self.first_token = self.first_audio = self.first_play = None
+
+    async def tokens(self, text: str) -> AsyncIterator[str]:
+        async for token in self.client.ask_stream(text):
+            if self.first_token is None:
+                self.first_token = time.monotonic()
+            yield token
+
+    async def _timed_tts(self, *args, **kwargs) -> AsyncIterator[bytes]:
+        stream = await self._tts(*args, **kwargs)
+
+        async def timed() -> AsyncIterator[bytes]:
+            async for chunk in stream:
+                if self.first_audio is None:
+                    self.first_audio = time.monotonic()
+                yield chunk
+
+        return timed()
+
+    async def _timed_play(self, stream: AsyncIterator[bytes]) -> bool:
+        async def timed() -> AsyncIterator[bytes]:
+            async for chunk in stream:
+                if self.first_play is None:
+                    self.first_play = time.monotonic()
+                yield chunk
+
+        return await self._play(timed())
+
+
+async def bench_turns(
+    api_url: str, vts: MockVTS, vts_url: str, turns: int
+) -> dict:
+    """Full turns: streamed chat, TTS, player and both lip-sync paths."""
+    config.BASE_URL = api_url
+    client = ChatClient(api_key="bench", system_prompt="")
+    conn = VTSConnection(vts_url, token_path=None)
+    await conn.connect()
+    vtube = VTubeClient(connection=conn)
+    streamer = VTubeStreamer(connection=conn)
+    await streamer.connect()
+    paths = {"streamer": streamer.lipsync, "vtube": LipSync(vtube.send_level)}
+    audio_player = player.get_player("mp3")
+    timer = TurnTimer(client, audio_player)
+    results: dict[str, list[float]] = {
+        "ttft": [], "ttfab": [], "ttps": [], "turn": [],
+    }
+    lip: dict[str, dict[str, list[float]]] = {
+        name: {"fps": [], "jitter_ms": []} for name in paths
+    }
+
+    try:
+        for i in range(turns):
+            name = "streamer" if i % 2 == 0 else "vtube"
+            lipsync = paths[name]
+            timer.reset()
+            start = time.monotonic()
+            scheduler = TTSScheduler(client, fmt="mp3")
+            producer = asyncio.create_task(
+                scheduler.feed(segment_stream(timer.tokens(f"question {i}")))
+            )
+            # Same playback path as the CLI
+            await cli.play_segments(scheduler, producer, lipsync)
+            results["turn"].append(time.monotonic() - start)
+            results["ttft"].append(timer.first_token - start)
+            results["ttfab"].append(timer.first_audio - start)
+            results["ttps"].append(timer.first_play - start)
+            # Let the scheduled envelope play out before measuring it.
+            tail = lipsync.scheduler.end_time - time.monotonic()
+            await asyncio.sleep(max(0.0, tail) + config.LIPSYNC_LATENCY + 0.2)
+            frames = vts.frame_stats(since=timer.first_play)
+            lip[name]["fps"].append(frames["fps"])
+            lip[name]["jitter_ms"].append(frames["jitter_ms"])
+    finally:
+        await player.close_players()
+        await paths["vtube"].close()
+        await streamer.close()
+        await conn.close()
+        await client.close()
+
+    out = {k: summarize(v) for k, v in results.items()}
+    out["lipsync"] = {
+        name: {k: summarize(v) for k, v in stats.items()} for name, stats in lip.items()
+    }
+    return out
+
+
+async def bench_throughput(
+    api_url: str, levels: list[int], duration: float, slo: float
+) -> dict:
+    """Concurrent sessions doing chat + TTS without playback."""
+    config.BASE_URL = api_url
+    base = ChatClient(api_key="bench", system_prompt="")
+    # The client-side limiter would cap the result, not the pipeline.
+    for upstream in base.upstreams:
+        for policy in upstream.policies.values():
+            policy.limiter.rate = policy.limiter.burst = 10**6
+    runs = []
+    try:
+        for level in levels:
+            ttfa: list[float] = []
+            done = 0
+            deadline = time.monotonic() + duration
+
+            async def worker(n: int) -> None:
+                nonlocal done
+                client = base.fork("")
+                timer = TurnTimer(client)
+                while time.monotonic() < deadline:
+                    timer.reset()
+                    start = time.monotonic()
+                    scheduler = TTSScheduler(client, fmt="mp3")
+                    producer = asyncio.create_task(
+                        scheduler.feed(segment_stream(timer.tokens(f"q {n}")))
+                    )
+                    try:
+                        async for segment in scheduler:
+                            async for _ in segment.aiter_bytes():
+                                pass
+                        await producer
+                    finally:
+                        await scheduler.aclose()
+                    ttfa.append(timer.first_audio - start)
+                    done += 1
+                await client.close()
+
+            start = time.monotonic()
+            await asyncio.gather(*(worker(n) for n in range(level)))
+            elapsed = time.monotonic() - start
+            run = {
+                "concurrency": level,
+                "turns_per_s": done / elapsed,
+                "ttfa": summarize(ttfa),
+            }
+            runs.append(run)
+            logging.info(
+                "concurrency %d: %.2f turns/s, ttfa p95 %.3fs",
+                level, run["turns_per_s"], run["ttfa"].get("p95", 0),
+            )
+    finally:
+        await base.close()
+    sustained = [r for r in runs if r["ttfa"].get("p95", float("inf")) <= slo]
+    return {
+        "runs": runs,
+        "slo_ttfa_p95": slo,
+        "max_sustained_turns_per_s": max(
+            (r["turns_per_s"] for r in sustained), default=0.0
+        ),
+    }
+
+
+async def bench_routing(asks: int) -> dict:
+    """Two providers with different latency: routing share and failover.
+
+    After ``asks`` questions the fast provider starts failing; the next
+    question must still be answered, by the slow one, with the history.
+    """
+    fast = MockOpenAI(ttft=0.05, token_interval=0)
+    slow = MockOpenAI(ttft=0.4, token_interval=0)
+    providers = [
+        Provider("slow", await slow.start(), "bench"),
+        Provider("fast", await fast.start(), "bench"),
+    ]
+    client = ChatClient(system_prompt="", providers=providers)
+    try:
+        for i in range(asks):
+            await client.ask(f"question {i}")
+        fast_share = fast.requests / asks
+        fast.status = 503
+        start = time.monotonic()
+        await client.ask("question after the outage")
+        failover = time.monotonic() - start
+        routes = client.router.stats
+    finally:
+        await client.close()
+        await fast.close()
+        await slow.close()
+    logging.info(
+        "routing: %.0f%% of requests to the fast provider, failover turn %.2fs",
+        fast_share * 100, failover,
+    )
+    return {
+        "fast_share": fast_share,
+        "failover_seconds": failover,
+        "history_messages": len(client.messages),
+        "routes": routes,
+    }
+
+
+def bench_startup(runs: int = 5) -> dict:
+    """Wall time of ``main.py --help`` and heavy modules loaded by ``import main``."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "main.py", "--help"],
+            cwd=here, stdout=subprocess.DEVNULL, check=True,
+        )
+        times.append(time.perf_counter() - start)
+    code = (
+        "import json, sys, main; "
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True
+    )
+    return {"help_seconds": summarize(times), "eager_imports": json.loads(out.stdout)}
+
+
+def _flatten(data, prefix: str = "") -> dict[str, float]:
+    out = {}
+    if isinstance(data, dict):
+        for k, v in data.items():
+            out.update(_flatten(v, f"{prefix}{k}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        out[prefix.rstrip(".")] = float(data)
+    return out
+
+
+def compare(old: dict, new: dict) -> None:
+    """Print metrics that exist in both result files with their change."""
+    a, b = _flatten(old.get("results", {})), _flatten(new.get("results", {}))
+    for key in sorted(a.keys() & b.keys()):
+        if a[key]:
+            change = (b[key] - a[key]) / abs(a[key]) * 100
+            print(f"{key:50s} {a[key]:10.4f} {b[key]:10.4f} {change:+7.1f}%")
+
+
+async def run_bench(args) -> dict:
+    api = MockOpenAI(
+        ttft=args.ttft,
+        token_interval=args.token_interval,
+        tts_latency=args.tts_latency,
+        chunk_size=args.chunk_size,
+        chunk_interval=args.chunk_interval,
+    )
+    vts = MockVTS(reply=True)
+    api_url = await api.start()
+    vts_url = await vts.start()
+    results: dict = {}
+    try:
+        results["turns"] = await bench_turns(api_url, vts, vts_url, args.turns)
+        if args.levels:
+            results["throughput"] = await bench_throughput(
+                api_url, args.levels, args.duration, args.slo
+            )
+        if args.routing_asks:
+            results["routing"] = await bench_routing(args.routing_asks)
+    finally:
+        await api.close()
+        await vts.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="End-to-end latency benchmark against local mock servers"
+    )
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--chunk-size", type=int, default=8192)
+    parser.add_argument("--chunk-interval", type=float, default=0.005)
+    parser.add_argument(
+        "--levels",
+        type=lambda s: [int(x) for x in s.split(",") if x],
+        default=[1, 4, 16],
+        help="comma-separated concurrency levels for the throughput test",
+    )
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--slo", type=float, default=1.5, help="max p95 time-to-first-audio"
+    )
+    parser.add_argument(
+        "--routing-asks",
+        type=int,
+        default=10,
+        help="questions for the two-provider routing test (0 skips it)",
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        default=config.STARTUP_BUDGET_MS,
+        help="fail if median CLI startup exceeds this many milliseconds",
+    )
+    parser.add_argument(
+        "--startup-only", action="store_true", help="only run the startup check"
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to diff against")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    startup = bench_startup()
+    median_ms = startup["help_seconds"]["p50"] * 1000
+    print(f"startup: {median_ms:.0f} ms (budget {args.startup_budget:.0f} ms)")
+    failed = median_ms > args.startup_budget or bool(startup["eager_imports"])
+    if startup["eager_imports"]:
+        print("imported at startup:", ", ".join(startup["eager_imports"]))
+    if args.startup_only:
+        raise SystemExit(1 if failed else 0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _install_stand_ins(tmpdir)
+        results = asyncio.run(run_bench(args))
+    results["startup"] = startup
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results["turns"], indent=2))
+    if "throughput" in results:
+        print(
+            "max sustained turns/s:",
+            round(results["throughput"]["max_sustained_turns_per_s"], 2),
+        )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
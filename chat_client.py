@@ -1,12 +1,19 @@
 import asyncio
+import copy
+import json
 import logging
-import os
 import time
-from typing import AsyncIterator
+from typing import AsyncIterator, Awaitable, Callable
 
 import httpx
 
 import config
+import http_pool
+from history import ConversationHistory
+from retry import DecorrelatedJitter, parse_retry_after
+from routing import Provider, Router, Upstream, load_providers
+from telemetry import telemetry
+from tts_cache import TTSCache
 
 
 class ChatClient:
@@ -16,87 +23,267 @@ class ChatClient:
         debug: bool = False,
         system_prompt: str | None = config.SYSTEM_PROMPT,
         history_limit: int = 40,
+        tts_cache: TTSCache | None = None,
+        providers: list[Provider] | None = None,
     ):
         self.debug = debug
-        self.history_limit = history_limit
-        self.messages: list[dict[str, str]] = []
-        if system_prompt:
-            self.messages.append({"role": "system", "content": system_prompt})
-        if api_key is None:
-            api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise RuntimeError("OPENAI_API_KEY environment variable is not set")
-        self._headers = {"Authorization": f"Bearer {api_key}"}
-        self.client = httpx.AsyncClient(
-            base_url=config.BASE_URL,
-            timeout=config.TIMEOUT,
-            headers=self._headers,
+        self.tts_cache = tts_cache
+        self.history = ConversationHistory(
+            system_prompt,
+            max_messages=history_limit,
+            summarizer=self.summarize if config.HISTORY_SUMMARIZE else None,
         )
+        if providers is None:
+            providers = load_providers(api_key)
+        self.http2 = http_pool.resolve_http2(config.HTTP2)
+        self.metrics = http_pool.ConnectionMetrics()
+        # The history lives here, not with a provider, so a conversation
+        # continues unchanged when requests move to another provider.
+        self.upstreams = [Upstream(p, self.metrics, self.http2) for p in providers]
+        self.router = Router(self.upstreams)
+        self._keepalive: list[asyncio.Task] = []
+        self._owns_client = True
 
-    async def _request_with_retry(self, func, *args, **kwargs):
+    def fork(self, system_prompt: str | None = config.SYSTEM_PROMPT) -> "ChatClient":
+        """Return a client with its own history sharing everything else.
+
+        The connection pool, TTS cache, rate limiters and circuit breakers
+        are shared with this client; closing the fork only drops its history.
+        """
+        clone = copy.copy(self)
+        clone._owns_client = False
+        clone._keepalive = []
+        clone.history = ConversationHistory(
+            system_prompt,
+            max_messages=self.history.max_messages,
+            summarizer=clone.summarize if config.HISTORY_SUMMARIZE else None,
+        )
+        return clone
+
+    async def warmup(self) -> None:
+        """Open connections to the API before the first question."""
+        await asyncio.gather(
+            *(
+                http_pool.warmup(
+                    u.client, connections=config.TTS_CONCURRENCY + 1, http2=self.http2
+                )
+                for u in self.upstreams
+            )
+        )
+
+    def start_keepalive(self, interval: float = config.HTTP_KEEPALIVE_INTERVAL) -> None:
+        """Keep pooled connections open across idle gaps."""
+        if interval > 0 and not self._keepalive:
+            self._keepalive = [
+                asyncio.create_task(http_pool.keepalive(u.client, interval))
+                for u in self.upstreams
+            ]
+
+    @property
+    def connection_stats(self) -> dict[str, float]:
+        return self.metrics.stats
+
+    async def _request_with_retry(
+        self,
+        send: Callable[[Upstream], Awaitable[httpx.Response]],
+        endpoint: str = "chat",
+    ) -> httpx.Response:
+        """Send a request with retries, failing over between providers.
+
+        ``send(upstream)`` issues the request on that upstream's client.
+        Every attempt goes to the best ranked provider for ``endpoint``
+        that has not been tried yet; after a failure the next provider is
+        tried at once. Once all of them have failed, attempts back off.
+        """
+        backoff = DecorrelatedJitter()
+        tried: set[Upstream] = set()
         for attempt in range(1, config.MAX_RETRIES + 1):
+            last = attempt == config.MAX_RETRIES
+            upstream = self.router.pick(endpoint, tried)
+            policy = upstream.policies[endpoint]
+            labels = {"endpoint": endpoint, "provider": upstream.name}
+            rate_limited = False
+            policy.breaker.check()
+            await policy.limiter.acquire()
             try:
                 start = time.monotonic()
-                resp = await func(*args, **kwargs)
+                resp = await send(upstream)
                 resp.raise_for_status()
                 elapsed = time.monotonic() - start
-                logging.debug("Request took %.2fs", elapsed)
+                logging.debug("Request to %s took %.2fs", upstream.name, elapsed)
+                telemetry.observe("http_request_seconds", elapsed, **labels)
+                policy.record_success(elapsed, resp.headers)
                 return resp
             except httpx.HTTPStatusError as e:
                 status = e.response.status_code
-                if 500 <= status < 600:
-                    delay = config.RETRY_BACKOFF**attempt
-                    logging.warning(
-                        "Server %s error, retry in %s s", status, delay
-                    )
-                    await asyncio.sleep(delay)
-                    continue
-                if status == 429:
-                    logging.warning(
-                        "\u041f\u0440\u0435\u0432\u044b\u0448\u0435\u043d \u043b\u0438\u043c\u0438\u0442 \u0437\u0430\u043f\u0440\u043e\u0441\u043e\u0432, \u0436\u0434\u0451\u043c 20 \u0441"
-                    )
-                    await asyncio.sleep(20)
-                    continue
-                raise
+                await e.response.aclose()
+                telemetry.inc("http_errors_total", status=status, **labels)
+                if status != 429 and not 500 <= status < 600:
+                    raise
+                policy.retries += 1
+                policy.record_error()
+                telemetry.inc("retries_total", **labels)
+                delay = parse_retry_after(e.response.headers) or backoff.next()
+                rate_limited = status == 429
+                if rate_limited:
+                    policy.limiter.pause(delay)
+                else:
+                    policy.breaker.record_failure()
+                reason = f"server {status} error"
             except (httpx.TimeoutException, httpx.TransportError) as e:
-                delay = config.RETRY_BACKOFF**attempt
-                logging.warning("Network error %s, retry in %s s", e, delay)
-                await asyncio.sleep(delay)
+                policy.retries += 1
+                policy.record_error()
+                telemetry.inc("http_errors_total", status="network", **labels)
+                telemetry.inc("retries_total", **labels)
+                policy.breaker.record_failure()
+                delay = backoff.next()
+                reason = f"network error {e}"
             except Exception:
                 logging.exception("Unexpected error")
                 raise
+            tried.add(upstream)
+            if last:
+                break
+            if self.router.has_fallback(endpoint, tried):
+                logging.warning("%s: %s, failing over", upstream.name, reason)
+                telemetry.inc("failovers_total", **labels)
+                continue
+            if rate_limited:
+                logging.warning(
+                    "\u041f\u0440\u0435\u0432\u044b\u0448\u0435\u043d \u043b\u0438\u043c\u0438\u0442 \u0437\u0430\u043f\u0440\u043e\u0441\u043e\u0432, \u0436\u0434\u0451\u043c %.1f \u0441",
+                    delay,
+                )
+            else:
+                logging.warning(
+                    "%s, retry in %.1f s", reason[:1].upper() + reason[1:], delay
+                )
+            await asyncio.sleep(delay)
         raise RuntimeError("Failed after retries")
 
-    async def ask(self, text: str) -> str:
-        self.messages.append({"role": "user", "content": text})
+    @property
+    def messages(self) -> list[dict[str, str]]:
+        return self.history.messages
+
+    def _chat_payload(self, upstream: Upstream, **extra) -> dict:
         payload = {
-            "model": config.TEXT_MODEL,
-            "messages": self.messages[-self.history_limit :],
+            "model": upstream.provider.text_model,
+            "messages": self.history.messages,
         }
+        payload.update(extra)
         if self.debug:
-            logging.debug("Chat payload: %s", payload)
-        resp = await self._request_with_retry(
-            self.client.post, "/chat/completions", json=payload
-        )
-        data = resp.json()
-        if self.debug and data.get("usage"):
-            usage = data["usage"]
+            logging.debug(
+                "Chat payload (~%d tokens): %s", self.history.tokens, payload
+            )
+        return payload
+
+    def _log_usage(self, usage: dict | None) -> None:
+        if usage:
+            telemetry.inc("tokens_total", usage.get("prompt_tokens") or 0, kind="prompt")
+            telemetry.inc(
+                "tokens_total", usage.get("completion_tokens") or 0, kind="completion"
+            )
+        if self.debug and usage:
             logging.debug(
                 "Tokens: prompt %s, completion %s",
                 usage.get("prompt_tokens"),
                 usage.get("completion_tokens"),
             )
+
+    async def ask(self, text: str) -> str:
+        self.history.append("user", text)
+        telemetry.mark("llm_request")
+        with telemetry.span("llm_request"):
+            resp = await self._request_with_retry(
+                lambda u: u.client.post(
+                    "/chat/completions", json=self._chat_payload(u)
+                )
+            )
+        telemetry.mark("llm_reply")
+        data = resp.json()
+        self._log_usage(data.get("usage"))
         reply = data["choices"][0]["message"]["content"].strip()
-        self.messages.append({"role": "assistant", "content": reply})
-        if len(self.messages) > self.history_limit:
-            self.messages = self.messages[-self.history_limit :]
+        self.history.append("assistant", reply)
         return reply
 
+    async def ask_stream(self, text: str) -> AsyncIterator[str]:
+        """Send ``text`` and yield reply tokens as they arrive (SSE).
+
+        The full reply is stored in history as a single assistant message
+        once the stream ends.
+        """
+        self.history.append("user", text)
+
+        def send(upstream: Upstream) -> Awaitable[httpx.Response]:
+            payload = self._chat_payload(
+                upstream, stream=True, stream_options={"include_usage": True}
+            )
+            request = upstream.client.build_request(
+                "POST", "/chat/completions", json=payload
+            )
+            return upstream.client.send(request, stream=True)
+
+        start = time.monotonic()
+        telemetry.mark("llm_request")
+        resp = await self._request_with_retry(send)
+        parts: list[str] = []
+        first = True
+        try:
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                self._log_usage(chunk.get("usage"))
+                for choice in chunk.get("choices") or ():
+                    delta = choice.get("delta", {}).get("content")
+                    if not delta:
+                        continue
+                    if first:
+                        ttft = time.monotonic() - start
+                        logging.debug("First token after %.2fs", ttft)
+                        telemetry.observe("first_token_seconds", ttft)
+                        telemetry.mark("first_token")
+                        first = False
+                    parts.append(delta)
+                    yield delta
+        finally:
+            await resp.aclose()
+            telemetry.mark("llm_reply")
+            reply = "".join(parts).strip()
+            if reply:
+                self.history.append("assistant", reply)
+
+    async def summarize(self, text: str) -> str:
+        """Summarize ``text`` with a one-off request outside the history."""
+        messages = [
+            {"role": "system", "content": config.HISTORY_SUMMARY_PROMPT},
+            {"role": "user", "content": text},
+        ]
+        resp = await self._request_with_retry(
+            lambda u: u.client.post(
+                "/chat/completions",
+                json={"model": u.provider.text_model, "messages": messages},
+            )
+        )
+        return resp.json()["choices"][0]["message"]["content"].strip()
+
     async def tts(
         self, text: str, voice: str = config.DEFAULT_VOICE, fmt: str = "mp3"
     ) -> AsyncIterator[bytes]:
+        # Hedging follows the latency history of the provider expected to
+        # serve the request, and its model is the one looked up in the cache
+        preferred = self.router.pick("speech")
+        if self.tts_cache is not None:
+            key = self.tts_cache.key(text, voice, preferred.provider.voice_model, fmt)
+            path = self.tts_cache.get(key)
+            if path:
+                logging.debug("TTS cache hit: %s", key)
+                telemetry.inc("tts_cache_total", result="hit")
+                return self.tts_cache.stream(path)
+            telemetry.inc("tts_cache_total", result="miss")
         params = {
-            "model": config.VOICE_MODEL,
             "voice": voice,
             "input": text,
             "response_format": fmt,
@@ -105,10 +292,37 @@ class ChatClient:
         if self.debug:
             dbg = {k: v for k, v in params.items() if k != "input"}
             logging.debug("TTS params: %s", dbg)
-        resp = await self._request_with_retry(
-            self.client.post, "/audio/speech", json=params
+
+        # Upstream that produced each response; a hedged request may get two
+        served: dict[httpx.Response, Upstream] = {}
+
+        async def send(upstream: Upstream) -> httpx.Response:
+            request = upstream.client.build_request(
+                "POST",
+                "/audio/speech",
+                json={"model": upstream.provider.voice_model, **params},
+            )
+            resp = await upstream.client.send(request, stream=True)
+            served[resp] = upstream
+            return resp
+
+        policy = preferred.policies["speech"]
+        resp = await policy.hedged(
+            lambda: self._request_with_retry(send, endpoint="speech")
         )
+        if self.tts_cache is not None:
+            # Stored under the model that produced the audio, which differs
+            # from the preferred one after a failover
+            model = served[resp].provider.voice_model
+            key = self.tts_cache.key(text, voice, model, fmt)
+            return self.tts_cache.tee(key, resp.aiter_bytes())
         return resp.aiter_bytes()
 
     async def close(self) -> None:
-        await self.client.aclose()
+        for task in self._keepalive:
+            task.cancel()
+        self._keepalive = []
+        await self.history.close()
+        if self._owns_client:
+            for upstream in self.upstreams:
+                await upstream.client.aclose()
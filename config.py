@@ -6,9 +6,189 @@ CHAT_ENDPOINT = f"{BASE_URL}/chat/completions"
 TTS_ENDPOINT = f"{BASE_URL}/audio/speech"
 TIMEOUT = 30
 MAX_RETRIES = 3
-RETRY_BACKOFF = 2
+# Retry delays use decorrelated jitter between these bounds (seconds) unless
+# the server sends Retry-After
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20
+# Client-side rate limits per endpoint: requests per second and burst size
+RATE_LIMIT_CHAT = (5, 5)
+RATE_LIMIT_SPEECH = (10, 10)
+# Circuit breaker: fail fast for CIRCUIT_RESET seconds after this many
+# consecutive upstream failures
+CIRCUIT_FAILURES = 5
+CIRCUIT_RESET = 30
+# Send a second TTS request if the first has not answered within this
+# latency percentile of recent requests
+TTS_HEDGE = False
+TTS_HEDGE_PERCENTILE = 0.95
 # Default system prompt used to initialize conversation history
 SYSTEM_PROMPT = ""
 
 # Enable VTube Studio lip sync by default. Can be overridden with --vtube/--no-vtube
 ENABLE_VTUBE = False
+
+# Stream chat completions and start TTS per sentence while the model is still
+# generating. Can be overridden with --stream/--no-stream
+STREAM_CHAT = True
+# Segmenting of streamed replies for TTS (characters)
+SEGMENT_MIN_CHARS = 12
+SEGMENT_MAX_CHARS = 220
+# The first segment may be cut at a comma once it is this long
+SEGMENT_FIRST_CLAUSE_CHARS = 24
+# Number of TTS requests kept in flight and segments downloaded ahead of
+# playback. The prefetch depth bounds memory on very long replies.
+TTS_CONCURRENCY = 3
+TTS_PREFETCH = 4
+
+# Lip sync: RMS envelope frame size, rate of MouthOpen updates sent to
+# VTube Studio and the audio output latency (seconds) the mouth is delayed by
+LIPSYNC_FRAME_MS = 20
+LIPSYNC_FPS = 30
+LIPSYNC_LATENCY = 0.1
+
+# On-disk cache of synthesized audio. Can be disabled with --no-tts-cache
+ENABLE_TTS_CACHE = True
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_MB = 256
+
+# Conversation history is trimmed to this approximate prompt size (tokens).
+# The system prompt is always kept.
+HISTORY_TOKEN_BUDGET = 6000
+# Collapse old turns into a summary message instead of dropping them once
+# the history reaches HISTORY_COMPACT_AT of the budget
+HISTORY_SUMMARIZE = False
+HISTORY_COMPACT_AT = 0.8
+HISTORY_SUMMARY_PROMPT = (
+    "Briefly summarize the conversation below, keeping facts, names and "
+    "promises that may matter later. Reply with the summary only."
+)
+
+# HTTP connection pool. HTTP2 needs the optional ``h2`` package
+# (pip install httpx[http2]); without it HTTP/1.1 is used.
+HTTP2 = False
+HTTP_MAX_CONNECTIONS = 10
+HTTP_MAX_KEEPALIVE = 10
+HTTP_KEEPALIVE_EXPIRY = 120
+# Open connections at startup so the first reply skips DNS/TLS. Can be
+# overridden with --warmup/--no-warmup
+HTTP_WARMUP = False
+# Ping the API after this many idle seconds to keep connections open
+# (0 disables)
+HTTP_KEEPALIVE_INTERVAL = 0
+
+# VTube Studio API. Plugin tokens are saved to VTS_TOKEN_FILE, one per
+# plugin name and developer, so the permission prompt is shown only once.
+VTS_URL = "ws://127.0.0.1:8001"
+VTS_TOKEN_FILE = ".vts_token"
+# Parameter injection: max messages per second, changes smaller than the
+# dead band are not sent, unchanged values are still refreshed this often
+# (VTube Studio resets injected parameters after about one second)
+VTS_MAX_FPS = 30
+VTS_DEADBAND = 0.01
+VTS_REFRESH = 0.5
+# Skip a frame while this many bytes are still waiting in the socket buffer
+VTS_MAX_BACKLOG = 16384
+
+# Server mode (server.py): one conversation per session id, sharing the
+# connection pool and TTS cache
+SERVER_HOST = "127.0.0.1"
+SERVER_HTTP_PORT = 8080
+SERVER_WS_PORT = 8081
+SERVER_MAX_SESSIONS = 500
+# Sessions unused for this many seconds are dropped
+SERVER_SESSION_IDLE = 900
+# Requests of one session handled at the same time; others wait
+SERVER_SESSION_CONCURRENCY = 1
+
+# Per-stage latency tracing. When enabled (--metrics), every turn is appended
+# to METRICS_TRACE_FILE as one JSON line and counters/histograms are written
+# to METRICS_PROM_FILE in the Prometheus text format. A non-zero METRICS_PORT
+# also serves them on http://127.0.0.1:<port>/metrics
+METRICS_ENABLED = False
+METRICS_TRACE_FILE = "trace.jsonl"
+METRICS_PROM_FILE = "metrics.prom"
+METRICS_PORT = 0
+
+# Batch pre-rendering (batch.py): lines rendered at the same time, the
+# default output directory and audio format. Files are meant for other
+# players (OBS etc.), so the default is mp3 rather than raw TTS_FORMAT
+BATCH_WORKERS = 8
+BATCH_OUTPUT_DIR = "rendered"
+BATCH_FORMAT = "mp3"
+
+# Viseme lip sync (--visemes): the spectrum of the voice also drives the
+# mouth form, wide for "ee" and round for "oo". VISEME_FORM_PARAM is the
+# VTube Studio input parameter that receives it
+VISEMES = False
+VISEME_FORM_PARAM = "MouthSmile"
+
+# Audio shared by the player and lip sync: synthesis of a segment waits while
+# a consumer is this many bytes behind
+AUDIO_BUFFER_MAX_LAG = 1024 * 1024
+
+# Audio format requested from the TTS API. "pcm" (raw 24 kHz samples) is
+# played and analysed without decoding; "mp3" or "aac" need about a third
+# of the bandwidth. Falls back to "mp3" when ffplay is not available. Only
+# formats in player.STREAM_FORMATS can be played live
+TTS_FORMAT = "pcm"
+
+# Startup budget checked by bench.py: median wall time of "main.py --help"
+STARTUP_BUDGET_MS = 250
+
+# Filler clips (--fillers) played when the reply has no audio yet after
+# FILLER_DELAY seconds. They are synthesized once per voice at startup
+ENABLE_FILLERS = False
+FILLER_DELAY = 1.2
+FILLER_PHRASES = ("Hmm...", "Let me think...", "Good question...", "One moment...")
+
+# Post-processing of "pcm" TTS audio before playback and lip sync: silence
+# quieter than SILENCE_THRESHOLD_DB is cut from both ends (keeping
+# SILENCE_PAD_MS) and the level is moved towards LOUDNESS_TARGET_DB, by at
+# most LOUDNESS_MAX_GAIN_DB. LOUDNESS_WINDOW is the time constant (seconds of
+# voice) of the running loudness estimate
+AUDIO_NORMALIZE = True
+SILENCE_THRESHOLD_DB = -45
+SILENCE_PAD_MS = 30
+LOUDNESS_TARGET_DB = -18
+LOUDNESS_MAX_GAIN_DB = 12
+LOUDNESS_WINDOW = 3.0
+
+# CPU-bound audio work (lip-sync analysis, loudness processing): "process"
+# analyses whole clips in AUDIO_WORKERS worker processes and streamed audio
+# in threads, "thread" uses threads only, "inline" runs on the event loop
+AUDIO_EXECUTOR = "process"
+AUDIO_WORKERS = 2
+# With --metrics, how often the event loop is checked for stalls (seconds)
+LOOP_LAG_INTERVAL = 0.1
+
+# Several OpenAI-compatible APIs can be listed here, e.g.
+#   {"name": "proxy", "base_url": "https://...", "key_env": "PROXY_API_KEY",
+#    "text_model": "gpt-4.1", "voice_model": "tts-1", "kinds": ("chat",)}
+# Every chat and speech request goes to the provider with the lowest recent
+# latency and error rate (chat and speech are ranked separately) and fails
+# over to the next one. The key is read from the "key_env" variable
+# (OPENAI_API_KEY by default). When empty, BASE_URL is the only provider
+PROVIDERS: list[dict] = []
+# Weight of the newest request in the per-provider latency and error
+# averages, seconds added to the latency of a provider whose requests all
+# fail, and the half-life (seconds) after which half of that is forgotten
+ROUTE_EWMA_ALPHA = 0.3
+ROUTE_ERROR_PENALTY = 5.0
+ROUTE_ERROR_HALFLIFE = 30
+
+# Viewer messages (ingest.py), read from a local socket (--listen PORT) and a
+# JSONL file followed like "tail -f" (--tail PATH). At most INGEST_QUEUE_SIZE
+# wait; when the queue is full INGEST_DROP_POLICY picks what is dropped:
+# "lowest" (lowest priority, oldest first), "oldest" or "newest" (the
+# incoming message). Messages older than INGEST_MAX_AGE seconds are skipped
+INGEST_HOST = "127.0.0.1"
+INGEST_QUEUE_SIZE = 50
+INGEST_DROP_POLICY = "lowest"
+INGEST_MAX_AGE = 60
+# Near-identical messages within this many seconds are answered once
+INGEST_DEDUP_WINDOW = 30
+# Pending messages answered together in one turn while the reply is busy
+INGEST_MAX_BATCH = 5
+INGEST_TAIL_POLL = 0.2
+# Local TCP port for viewer messages (0: only with --listen)
+INGEST_PORT = 0
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Coroutine
+
+
+class AsyncInput:
+    """Read console lines in a daemon thread without blocking the loop.
+
+    ``input()`` runs in a background thread and every line is handed to the
+    event loop through a queue, so websocket keep-alives, prefetching and
+    playback keep running while the user types.
+    """
+
+    def __init__(self, prompt: str = "> ") -> None:
+        self.prompt = prompt
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                line = input(self.prompt)
+            except (EOFError, KeyboardInterrupt):
+                line = None
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, line)
+            if line is None:
+                return
+
+    async def readline(self) -> str | None:
+        """Return the next line, or None at end of input."""
+        if self._thread is None:
+            self.start()
+        return await self._queue.get()
+
+
+class TurnController:
+    """Run one reply at a time and allow interrupting it.
+
+    :meth:`start` launches a turn as a task. :meth:`cancel` cancels the
+    running turn (its chat, TTS and playback tasks clean up through their
+    ``finally`` blocks) and then calls ``on_stop`` to silence audio that was
+    already handed to the player.
+    """
+
+    def __init__(self, on_stop: Callable[[], Awaitable[None]] | None = None) -> None:
+        self.on_stop = on_stop
+        self._task: asyncio.Task | None = None
+
+    @property
+    def busy(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, coro: Coroutine) -> asyncio.Task:
+        if self.busy:
+            raise RuntimeError("a turn is already running")
+        self._task = asyncio.create_task(coro)
+        return self._task
+
+    async def cancel(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            logging.debug("Interrupting current reply")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.on_stop is not None:
+            await self.on_stop()
+
+    async def wait(self) -> None:
+        """Wait for the running turn to finish."""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
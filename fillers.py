@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator
+
+import config
+from audio_executor import executor
+from audio_process import process_clip
+from player import play_stream
+from telemetry import telemetry
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from chat_client import ChatClient
+    from lipsync import LipSync
+
+
+@dataclass
+class Filler:
+    """A short synthesized clip and its lip-sync frames."""
+
+    text: str
+    audio: bytes
+    frames: "np.ndarray | None" = None
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        yield self.audio
+
+
+class FillerLibrary:
+    """Filler clips played while the reply is still on its way.
+
+    Each phrase is synthesized once per voice with :meth:`ChatClient.tts`
+    (and lands in the TTS cache, so restarts are cheap) and kept in memory
+    together with its lip-sync frames. :meth:`mask` plays a random clip if
+    the reply's first audio is not ready within ``delay`` seconds. The
+    reply is then written to the same player right after the clip, so it
+    follows without a gap.
+    """
+
+    def __init__(
+        self,
+        client: "ChatClient",
+        voice: str = config.DEFAULT_VOICE,
+        fmt: str = config.TTS_FORMAT,
+        phrases: tuple[str, ...] = config.FILLER_PHRASES,
+        delay: float = config.FILLER_DELAY,
+    ) -> None:
+        self.client = client
+        self.voice = voice
+        self.fmt = fmt
+        self.phrases = phrases
+        self.delay = delay
+        self.clips: list[Filler] = []
+        self._last: Filler | None = None
+
+    async def _synthesize(self, text: str, lipsync: "LipSync | None") -> Filler:
+        stream = await self.client.tts(text, voice=self.voice, fmt=self.fmt)
+        audio = b"".join([chunk async for chunk in stream])
+        if self.fmt == "pcm" and config.AUDIO_NORMALIZE:
+            audio = await executor.run(process_clip, audio)
+        frames = await lipsync.analyze_audio(audio) if lipsync else None
+        return Filler(text, audio, frames)
+
+    async def load(self, lipsync: "LipSync | None" = None) -> None:
+        """Synthesize all phrases; phrases that fail are skipped."""
+        results = await asyncio.gather(
+            *(self._synthesize(text, lipsync) for text in self.phrases),
+            return_exceptions=True,
+        )
+        for text, result in zip(self.phrases, results):
+            if isinstance(result, Exception):
+                logging.warning("Filler %r not available: %s", text, result)
+            else:
+                self.clips.append(result)
+        logging.debug("Loaded %d filler clips", len(self.clips))
+
+    def pick(self) -> Filler | None:
+        """Random clip, not the same one twice in a row."""
+        choices = [c for c in self.clips if c is not self._last] or self.clips
+        if not choices:
+            return None
+        self._last = random.choice(choices)
+        return self._last
+
+    async def mask(self, ready: asyncio.Event, lipsync: "LipSync | None" = None) -> bool:
+        """Play a filler unless ``ready`` is set within the delay.
+
+        Returns True if a filler was played.
+        """
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(ready.wait(), self.delay)
+            return False
+        except asyncio.TimeoutError:
+            pass
+        clip = self.pick()
+        if clip is None:
+            return False
+        logging.debug(
+            "No audio after %.2fs, playing filler %r", time.monotonic() - start, clip.text
+        )
+        telemetry.mark("filler_start")
+        telemetry.inc("fillers_total")
+        if lipsync and clip.frames is not None:
+            lipsync.play_frames(clip.frames)
+        await play_stream(clip.aiter_bytes(), fmt=self.fmt)
+        return True
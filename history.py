@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+import config
+
+Summarizer = Callable[[str], Awaitable[str]]
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: ~4 chars per token for ASCII, ~2.5 otherwise."""
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    other = len(text) - ascii_chars
+    return MESSAGE_OVERHEAD + int(ascii_chars / 4 + other / 2.5 + 0.5)
+
+
+class ConversationHistory:
+    """Chat history trimmed to a token budget.
+
+    Token counts are estimated once per message and kept as a running
+    total, so trimming is O(1) per dropped message instead of re-slicing
+    the whole list on every request. The system prompt is pinned and never
+    dropped. With a ``summarizer`` the oldest turns are collapsed into a
+    summary message once the history reaches ``compact_at`` of the budget.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str | None = None,
+        token_budget: int = config.HISTORY_TOKEN_BUDGET,
+        max_messages: int | None = None,
+        summarizer: Summarizer | None = None,
+        compact_at: float = config.HISTORY_COMPACT_AT,
+    ) -> None:
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.summarizer = summarizer
+        self.compact_at = compact_at
+        self._system: dict[str, str] | None = None
+        self._system_tokens = 0
+        self._summary: dict[str, str] | None = None
+        self._summary_tokens = 0
+        self._turns: deque[dict[str, str]] = deque()
+        self._costs: deque[int] = deque()
+        self._turn_tokens = 0
+        self._compacting: asyncio.Task | None = None
+        if system_prompt:
+            self.set_system(system_prompt)
+
+    def set_system(self, content: str) -> None:
+        self._system = {"role": "system", "content": content}
+        self._system_tokens = estimate_tokens(content)
+
+    @property
+    def messages(self) -> list[dict[str, str]]:
+        head = [m for m in (self._system, self._summary) if m]
+        return head + list(self._turns)
+
+    @property
+    def tokens(self) -> int:
+        return self._system_tokens + self._summary_tokens + self._turn_tokens
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def append(self, role: str, content: str) -> None:
+        cost = estimate_tokens(content)
+        self._turns.append({"role": role, "content": content})
+        self._costs.append(cost)
+        self._turn_tokens += cost
+        self._trim()
+        self._maybe_compact()
+
+    def _popleft(self) -> None:
+        self._turn_tokens -= self._costs.popleft()
+        self._turns.popleft()
+
+    def _over(self) -> bool:
+        if self.max_messages and len(self._turns) > self.max_messages:
+            return True
+        return self.tokens > self.token_budget
+
+    def _trim(self) -> None:
+        # Keep at least the newest message even if it is over budget alone.
+        while len(self._turns) > 1 and self._over():
+            self._popleft()
+        # Never start the visible history with an orphaned reply.
+        while len(self._turns) > 1 and self._turns[0]["role"] == "assistant":
+            self._popleft()
+
+    def _maybe_compact(self) -> None:
+        if self.summarizer is None or len(self._turns) < 4:
+            return
+        if self._compacting is not None and not self._compacting.done():
+            return
+        if self.tokens < self.token_budget * self.compact_at:
+            return
+        self._compacting = asyncio.create_task(self.compact())
+
+    async def compact(self) -> None:
+        """Summarize the older half of the turns into the summary message."""
+        target = self._turn_tokens / 2
+        batch: list[dict[str, str]] = []
+        freed = 0
+        for msg, cost in zip(self._turns, self._costs):
+            if freed >= target or len(batch) >= len(self._turns) - 2:
+                break
+            batch.append(msg)
+            freed += cost
+        if not batch:
+            return
+        parts = []
+        if self._summary:
+            parts.append(self._summary["content"])
+        parts += [f"{m['role']}: {m['content']}" for m in batch]
+        try:
+            summary = await self.summarizer("\n".join(parts))
+        except Exception as e:
+            logging.warning("History compaction failed: %s", e)
+            return
+        ids = {id(m) for m in batch}
+        while self._turns and id(self._turns[0]) in ids:
+            self._popleft()
+        self._summary = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation: {summary}",
+        }
+        self._summary_tokens = estimate_tokens(self._summary["content"])
+        logging.debug(
+            "History compacted: %d messages -> summary, now ~%d tokens",
+            len(batch),
+            self.tokens,
+        )
+
+    async def close(self) -> None:
+        if self._compacting is not None and not self._compacting.done():
+            self._compacting.cancel()
+            try:
+                await self._compacting
+            except asyncio.CancelledError:
+                pass
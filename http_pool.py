@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import httpx
+
+import config
+
+try:
+    import h2  # noqa: F401
+except Exception:  # pragma: no cover - optional dependency
+    h2 = None
+
+
+class ConnectionMetrics:
+    """Count new vs reused connections and time handshakes.
+
+    Installed as a request event hook; it attaches an httpcore ``trace``
+    callback to every request.
+    """
+
+    def __init__(self, window: int = 100) -> None:
+        self.requests = 0
+        self.new_connections = 0
+        self.handshakes: deque[float] = deque(maxlen=window)
+
+    async def on_request(self, request: httpx.Request) -> None:
+        self.requests += 1
+        started: list[float] = []
+
+        async def trace(event: str, info: dict) -> None:
+            if event == "connection.connect_tcp.started":
+                started.append(time.monotonic())
+                self.new_connections += 1
+            elif started and event in (
+                "connection.start_tls.complete",
+                "http11.send_request_headers.started",
+                "http2.send_connection_init.complete",
+            ):
+                self.handshakes.append(time.monotonic() - started.pop())
+
+        request.extensions["trace"] = trace
+
+    @property
+    def stats(self) -> dict[str, float]:
+        reused = self.requests - self.new_connections
+        hs = sorted(self.handshakes)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reuse_ratio": reused / self.requests if self.requests else 0.0,
+            "handshake_avg": sum(hs) / len(hs) if hs else 0.0,
+            "handshake_max": hs[-1] if hs else 0.0,
+        }
+
+
+def resolve_http2(requested: bool = config.HTTP2) -> bool:
+    """Return whether HTTP/2 can be used, warning if ``h2`` is missing."""
+    if requested and h2 is None:
+        logging.warning("HTTP/2 requested but h2 is not installed, using HTTP/1.1")
+        return False
+    return requested
+
+
+def create_client(
+    headers: dict[str, str],
+    metrics: ConnectionMetrics | None = None,
+    http2: bool = False,
+    base_url: str = config.BASE_URL,
+) -> httpx.AsyncClient:
+    """Create the shared API client with explicit pool limits."""
+    hooks = {}
+    if metrics is not None:
+        hooks = {"request": [metrics.on_request]}
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=config.TIMEOUT,
+        headers=headers,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks=hooks,
+    )
+
+
+async def _ping(client: httpx.AsyncClient) -> None:
+    try:
+        resp = await client.get("/models")
+        await resp.aclose()
+    except httpx.HTTPError as e:
+        logging.debug("Connection ping failed: %s", e)
+
+
+async def warmup(
+    client: httpx.AsyncClient, connections: int = 1, http2: bool = False
+) -> float:
+    """Open ``connections`` pooled connections ahead of the first request.
+
+    With HTTP/2 one connection is multiplexed, so only one is opened.
+    Returns the time it took.
+    """
+    start = time.monotonic()
+    if http2:
+        connections = 1
+    await asyncio.gather(*(_ping(client) for _ in range(max(1, connections))))
+    elapsed = time.monotonic() - start
+    logging.debug("Warm-up of %d connection(s) took %.2fs", connections, elapsed)
+    return elapsed
+
+
+async def keepalive(
+    client: httpx.AsyncClient, interval: float = config.HTTP_KEEPALIVE_INTERVAL
+) -> None:
+    """Ping the API whenever ``client`` was idle for ``interval`` seconds.
+
+    Activity is tracked per client, so a provider that is not used is kept
+    warm while another one is busy.
+    """
+    last_activity = time.monotonic()
+
+    async def touch(_: httpx.Request | httpx.Response) -> None:
+        nonlocal last_activity
+        last_activity = time.monotonic()
+
+    hooks = client.event_hooks
+    hooks["request"].append(touch)
+    hooks["response"].append(touch)
+    try:
+        while True:
+            idle = time.monotonic() - last_activity
+            if idle >= interval:
+                logging.debug("Keep-alive ping after %.0fs idle", idle)
+                await _ping(client)
+                idle = 0
+            await asyncio.sleep(interval - idle)
+    finally:
+        hooks["request"].remove(touch)
+        hooks["response"].remove(touch)
@@ -0,0 +1,312 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import config
+from telemetry import telemetry
+from tts_cache import normalize_text
+
+# Priority of lines typed in the console; viewer messages default to 0
+OPERATOR_PRIORITY = 100
+DROP_POLICIES = ("lowest", "oldest", "newest")
+
+_NOT_WORD = re.compile(r"[\W_]+")
+_REPEATS = re.compile(r"(.)\1{2,}")
+
+
+@dataclass
+class Message:
+    """One incoming prompt.
+
+    ``merge`` is False for messages that must get a turn of their own
+    (console input). ``count`` grows when duplicates of it arrive.
+    """
+
+    text: str
+    author: str = ""
+    priority: int = 0
+    source: str = ""
+    merge: bool = True
+    received: float = field(default_factory=time.monotonic)
+    count: int = 1
+
+    def prompt(self) -> str:
+        return f"{self.author}: {self.text}" if self.author else self.text
+
+
+def dedup_key(text: str) -> str:
+    """Key under which near-identical messages collide.
+
+    Case, punctuation, emoji and spacing are ignored and runs of a repeated
+    character are shortened, so "Hiii!!" and "hii" are the same message.
+    """
+    text = _NOT_WORD.sub(" ", normalize_text(text).casefold())
+    return _REPEATS.sub(r"\1\1", text).strip()
+
+
+def parse_line(line: str, source: str = "") -> Message | None:
+    """A JSON object (``text``, ``author``, ``priority``) or a plain line."""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith("{"):
+        try:
+            data = json.loads(line)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            text = str(data.get("text") or data.get("message") or "").strip()
+            if not text:
+                return None
+            priority = data.get("priority") or 0
+            try:
+                priority = int(priority)
+            except (TypeError, ValueError):
+                logging.warning("Invalid message priority %r, using 0", priority)
+                priority = 0
+            return Message(
+                text,
+                author=str(data.get("author") or data.get("user") or ""),
+                priority=priority,
+                source=source,
+            )
+    return Message(line, source=source)
+
+
+def _put_line(put: "Put", line: bytes, source: str) -> None:
+    """Queue one received line; a line that cannot be read is skipped."""
+    try:
+        message = parse_line(line.decode("utf-8", "replace"), source)
+    except Exception:
+        logging.exception("Skipped unreadable %s message: %r", source, line[:200])
+        return
+    if message is not None:
+        put(message)
+
+
+def merge_messages(messages: list[Message]) -> str:
+    """Prompt for one turn answering all ``messages``, one per line."""
+    return "\n".join(m.prompt() for m in messages)
+
+
+class MessageQueue:
+    """Bounded priority queue of pending messages.
+
+    Higher ``priority`` is served first, then older messages. A message
+    whose :func:`dedup_key` matches one that is waiting, or one taken
+    within ``dedup_window`` seconds, is dropped (the waiting one counts
+    it). When ``maxsize`` messages wait, ``policy`` decides what is
+    dropped: the ``lowest`` priority (oldest among equals), the ``oldest``
+    or the ``newest``, i.e. the incoming one. Messages that waited longer
+    than ``max_age`` are skipped. Together this bounds how late an answer
+    can come during a burst.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = config.INGEST_QUEUE_SIZE,
+        policy: str = config.INGEST_DROP_POLICY,
+        max_age: float = config.INGEST_MAX_AGE,
+        dedup_window: float = config.INGEST_DEDUP_WINDOW,
+    ) -> None:
+        if policy not in DROP_POLICIES:
+            raise ValueError(
+                f"Unknown drop policy {policy!r}, expected one of {DROP_POLICIES}"
+            )
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.max_age = max_age
+        self.dedup_window = dedup_window
+        self._heap: list[tuple[int, int, Message]] = []
+        self._pending: dict[str, Message] = {}
+        self._taken: dict[str, float] = {}
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _drop(self, message: Message, reason: str) -> None:
+        self.dropped += 1
+        telemetry.inc("ingest_dropped_total", reason=reason)
+        logging.debug("Dropped message (%s): %s", reason, message.text[:60])
+
+    def _forget(self, message: Message) -> str:
+        key = dedup_key(message.text)
+        if self._pending.get(key) is message:
+            del self._pending[key]
+        return key
+
+    def _remove(self, entry: tuple[int, int, Message]) -> None:
+        self._heap.remove(entry)
+        heapq.heapify(self._heap)
+        self._forget(entry[2])
+
+    def close(self) -> None:
+        """No more messages; :meth:`get_batch` returns [] once drained."""
+        self.closed = True
+        self._ready.set()
+
+    def _gauge(self) -> None:
+        telemetry.set("ingest_queue_depth", len(self._heap))
+
+    def put(self, message: Message) -> bool:
+        """Queue ``message``; False if it was dropped."""
+        telemetry.inc("ingest_messages_total", source=message.source or "console")
+        now = time.monotonic()
+        self._taken = {
+            k: t for k, t in self._taken.items() if now - t < self.dedup_window
+        }
+        key = dedup_key(message.text)
+        if message.merge:
+            if key in self._pending:
+                self._pending[key].count += 1
+                self._drop(message, "duplicate")
+                return False
+            if key in self._taken:
+                self._drop(message, "duplicate")
+                return False
+        if len(self._heap) >= self.maxsize:
+            if self.policy == "newest":
+                self._drop(message, "full")
+                return False
+            if self.policy == "oldest":
+                victim = min(self._heap, key=lambda e: e[1])
+            else:
+                victim = max(self._heap, key=lambda e: (e[0], -e[1]))
+            if self.policy == "lowest" and -victim[0] > message.priority:
+                # Everything waiting is more important than this one
+                self._drop(message, "full")
+                return False
+            self._remove(victim)
+            self._drop(victim[2], "full")
+        heapq.heappush(self._heap, (-message.priority, next(self._seq), message))
+        if message.merge:
+            self._pending[key] = message
+        self._ready.set()
+        self._gauge()
+        return True
+
+    def _pop(self) -> Message | None:
+        """Next message that is not too old, or None if none is left."""
+        now = time.monotonic()
+        while self._heap:
+            _, _, message = heapq.heappop(self._heap)
+            key = self._forget(message)
+            if self.max_age and now - message.received > self.max_age:
+                self._drop(message, "stale")
+                continue
+            if message.merge:
+                self._taken[key] = now
+            telemetry.observe("ingest_wait_seconds", now - message.received)
+            return message
+        return None
+
+    async def get_batch(self, max_batch: int = config.INGEST_MAX_BATCH) -> list[Message]:
+        """Wait for messages and take the next turn's worth.
+
+        The most important message comes first; if it may be merged, up to
+        ``max_batch - 1`` more mergeable messages are taken with it. Returns
+        an empty list when the queue is closed and empty.
+        """
+        while True:
+            first = self._pop()
+            if first is not None:
+                break
+            if self.closed:
+                return []
+            self._ready.clear()
+            self._gauge()
+            await self._ready.wait()
+        batch = [first]
+        if first.merge:
+            keep = []
+            while self._heap and len(batch) < max_batch:
+                if not self._heap[0][2].merge:
+                    keep.append(heapq.heappop(self._heap))
+                    continue
+                message = self._pop()
+                if message is not None:
+                    batch.append(message)
+            for entry in keep:
+                heapq.heappush(self._heap, entry)
+        if len(batch) > 1:
+            telemetry.inc("ingest_merged_total", len(batch))
+        self._gauge()
+        return batch
+
+
+Put = Callable[[Message], bool]
+
+
+class SocketSource:
+    """Messages sent to a local TCP port, one JSON object or line each.
+
+    For example from a chat bot: ``{"author": "name", "text": "hi"}``.
+    """
+
+    name = "socket"
+
+    def __init__(self, port: int, host: str = config.INGEST_HOST) -> None:
+        self.host = host
+        self.port = port
+
+    async def run(self, put: Put) -> None:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                while line := await reader.readline():
+                    _put_line(put, line, self.name)
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, self.host, self.port)
+        logging.info("Reading viewer messages on %s:%s", self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+
+class TailSource:
+    """Lines appended to a JSONL file, followed like ``tail -f``.
+
+    Only lines written after startup are read. A file that is truncated or
+    replaced is read again from its start.
+    """
+
+    name = "tail"
+
+    def __init__(self, path: str, poll: float = config.INGEST_TAIL_POLL) -> None:
+        self.path = path
+        self.poll = poll
+
+    async def run(self, put: Put) -> None:
+        pos = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        partial = b""
+        logging.info("Following viewer messages in %s", self.path)
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                continue
+            if size < pos:
+                pos, partial = 0, b""
+            if size == pos:
+                continue
+            with open(self.path, "rb") as f:
+                f.seek(pos)
+                data = f.read()
+                pos = f.tell()
+            *lines, partial = (partial + data).split(b"\n")
+            for line in lines:
+                _put_line(put, line, self.name)
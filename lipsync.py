@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+import numpy as np
+
+import config
+from audio_executor import executor
+from audio_decode import (
+    PCMDecoder,
+    RawPCMDecoder,
+    decode_pcm,
+    decoded_rate,
+    open_decoder,
+)
+from telemetry import telemetry
+from visemes import VisemeEngine, analyze_pcm
+
+# Receives a float level, or a row of parameter values with a VisemeEngine
+LevelSink = Callable[[float | np.ndarray], Awaitable[None]]
+
+
+def rms_envelope(
+    pcm: bytes | bytearray | memoryview | np.ndarray,
+    sample_rate: int,
+    frame_ms: int = config.LIPSYNC_FRAME_MS,
+    gain: float = 1.0,
+) -> np.ndarray:
+    """Return the RMS level of every ``frame_ms`` frame of s16le mono PCM.
+
+    Values are scaled by ``gain`` and clamped to 0..1. A trailing partial
+    frame is included.
+    """
+    sig = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, np.int16)
+    sig = sig.astype(np.float32) / 32768
+    window = max(1, sample_rate * frame_ms // 1000)
+    full = len(sig) // window * window
+    frames = sig[:full].reshape(-1, window)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    if full < len(sig):
+        tail = sig[full:]
+        rms = np.append(rms, np.sqrt(np.mean(tail * tail)))
+    return np.minimum(rms * gain, 1.0)
+
+
+class _Utterance:
+    __slots__ = ("start", "levels")
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.levels = np.zeros(0, np.float32)
+
+
+class LipSyncScheduler:
+    """Send envelope values to a sink in step with the playback clock.
+
+    Utterances are laid out on one timeline in the order they are handed to
+    the player: an utterance starts when its first chunk is written, or
+    when the previous one ends if audio is still queued. A background task
+    ticks at ``fps`` and sends the loudest envelope value since the last
+    tick, delayed by ``latency`` to account for output buffering.
+
+    Frames may also be rows of several parameters (first column the mouth
+    opening); then the row of the loudest frame is sent, and ``rest`` once
+    the audio ends.
+    """
+
+    def __init__(
+        self,
+        sink: LevelSink,
+        frame_ms: int = config.LIPSYNC_FRAME_MS,
+        fps: float = config.LIPSYNC_FPS,
+        latency: float = config.LIPSYNC_LATENCY,
+        rest: float | np.ndarray = 0.0,
+    ) -> None:
+        self.sink = sink
+        self.rest = rest
+        self.frame = frame_ms / 1000
+        self.fps = fps
+        self.latency = latency
+        self._queue: list[_Utterance] = []
+        self._current: _Utterance | None = None
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._last_pos: float | None = None
+
+    @property
+    def end_time(self) -> float:
+        """Playback clock time at which the queued audio ends."""
+        if not self._queue:
+            return 0.0
+        last = self._queue[-1]
+        return last.start + len(last.levels) * self.frame
+
+    def begin(self, at: float | None = None) -> None:
+        """Start a new utterance at ``at`` or when queued audio ends."""
+        now = time.monotonic() if at is None else at
+        self._current = _Utterance(max(now, self.end_time))
+        self._queue.append(self._current)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+
+    def push(self, levels: np.ndarray) -> None:
+        """Append envelope frames to the current utterance."""
+        if self._current is None:
+            self.begin()
+        cur = self._current
+        levels = levels.astype(np.float32)
+        cur.levels = np.concatenate((cur.levels, levels)) if len(cur.levels) else levels
+
+    def end(self) -> None:
+        self._current = None
+
+    def clear(self) -> None:
+        """Drop everything not played yet (e.g. when playback is stopped)."""
+        self._queue.clear()
+        self._current = None
+        self._wake.set()
+
+    def _level_at(self, pos: float) -> float | None:
+        while self._queue:
+            utt = self._queue[0]
+            end = utt.start + len(utt.levels) * self.frame
+            if pos < end or utt is self._current:
+                break
+            self._queue.pop(0)
+        for utt in self._queue:
+            if pos < utt.start:
+                return None
+            i1 = int((pos - utt.start) / self.frame)
+            if i1 >= len(utt.levels):
+                continue
+            prev = self._last_pos if self._last_pos is not None else pos
+            i0 = max(0, min(i1, int((prev - utt.start) / self.frame)))
+            frames = utt.levels[i0 : i1 + 1]
+            if frames.ndim == 1:
+                return float(frames.max())
+            return frames[frames[:, 0].argmax()]
+        return None
+
+    async def _run(self) -> None:
+        period = 1 / self.fps
+        closed = True
+        next_tick = time.monotonic()
+        while True:
+            if not self._queue and closed:
+                self._wake.clear()
+                await self._wake.wait()
+                next_tick = time.monotonic()
+            pos = time.monotonic() - self.latency
+            level = self._level_at(pos)
+            self._last_pos = pos
+            if level is not None:
+                await self.sink(level)
+                closed = False
+            elif not closed:
+                await self.sink(self.rest)
+                closed = True
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                logging.debug("Lip sync tick late by %.3fs", -delay)
+                next_tick = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class LipSync:
+    """Decode utterances, compute their envelope and schedule it.
+
+    ``feed`` receives the same compressed chunks that go to the player, in
+    the same order, so the envelope timeline follows the audio the viewer
+    hears rather than the download speed. With an ``engine`` the sink gets
+    rows of viseme parameters instead of a single RMS level.
+    """
+
+    def __init__(
+        self,
+        sink: LevelSink,
+        fmt: str = "mp3",
+        gain: float = 1.0,
+        frame_ms: int = config.LIPSYNC_FRAME_MS,
+        fps: float = config.LIPSYNC_FPS,
+        latency: float = config.LIPSYNC_LATENCY,
+        engine: VisemeEngine | None = None,
+    ) -> None:
+        self.fmt = fmt
+        self.gain = gain
+        self.frame_ms = frame_ms
+        self.engine = engine
+        rest = engine.rest if engine is not None else 0.0
+        self.scheduler = LipSyncScheduler(sink, frame_ms, fps, latency, rest)
+        self._decoder: PCMDecoder | RawPCMDecoder | None = None
+        self._reader: asyncio.Task | None = None
+        self._scheduled = False
+
+    async def begin_utterance(self) -> None:
+        await self.end_utterance()
+        self._scheduled = False
+        if self.engine is not None:
+            self.engine.reset()
+        self._decoder = open_decoder(self.fmt)
+        await self._decoder.start()
+        self._reader = asyncio.create_task(self._read(self._decoder))
+
+    async def feed(self, chunk: bytes) -> None:
+        if self._decoder is None:
+            await self.begin_utterance()
+        if not self._scheduled:
+            self.scheduler.begin()
+            self._scheduled = True
+        await self._decoder.feed(chunk)
+
+    async def end_utterance(self) -> None:
+        """Wait until the utterance is fully decoded and scheduled."""
+        decoder, reader = self._decoder, self._reader
+        self._decoder = self._reader = None
+        if decoder is None:
+            return
+        await decoder.finish()
+        try:
+            with telemetry.span("decode_drain"):
+                await reader
+            telemetry.mark("decode_complete", first=False)
+        finally:
+            await decoder.close()
+            self.scheduler.end()
+
+    async def _read(self, decoder: PCMDecoder | RawPCMDecoder) -> None:
+        pending = bytearray()
+        async for pcm in decoder:
+            # Known once a WAV header has been read
+            step = decoder.sample_rate * self.frame_ms // 1000 * 2
+            telemetry.mark("decode_first_pcm")
+            telemetry.inc("decoded_bytes_total", len(pcm))
+            pending += pcm
+            usable = len(pending) - len(pending) % step
+            if usable:
+                block = pending[:usable]
+                del pending[:usable]
+                self.scheduler.push(await executor.run(self._analyze, block, decoder))
+        if len(pending) >= 2:
+            usable = len(pending) // 2 * 2
+            self.scheduler.push(
+                await executor.run(self._analyze, pending[:usable], decoder)
+            )
+
+    def _analyze(
+        self, pcm: bytearray, decoder: PCMDecoder | RawPCMDecoder
+    ) -> np.ndarray:
+        if self.engine is not None:
+            return self.engine.process(pcm)
+        return rms_envelope(pcm, decoder.sample_rate, self.frame_ms, self.gain)
+
+    async def analyze_audio(self, audio: bytes) -> np.ndarray:
+        """Frames of a complete clip, to be played with :meth:`play_frames`."""
+        pcm = await decode_pcm(audio, self.fmt)
+        rate = decoded_rate(self.fmt)
+        if self.engine is not None:
+            return await executor.frames(
+                analyze_pcm, pcm, rate, self.frame_ms, self.engine.gain, columns=2
+            )
+        return await executor.frames(rms_envelope, pcm, rate, self.frame_ms, self.gain)
+
+    def play_frames(self, frames: np.ndarray) -> None:
+        """Schedule precomputed frames for audio handed to the player now."""
+        self.scheduler.begin()
+        self.scheduler.push(frames)
+        self.scheduler.end()
+
+    def stop(self) -> None:
+        """Forget scheduled levels; the mouth closes on the next tick."""
+        self.scheduler.clear()
+
+    async def close(self) -> None:
+        await self.end_utterance()
+        await self.scheduler.close()
@@ -2,20 +2,135 @@ import argparse
 import asyncio
 import logging
 import os
+import time
 
 import config
-from dotenv import load_dotenv, set_key
-from pathlib import Path
-from chat_client import ChatClient
-from player import play_file, set_audio_output
-from vtube import VTubeClient
-from vtube_stream import VTubeStreamer
-import io
-import tempfile
+from typing import TYPE_CHECKING, AsyncIterator
+from audio_buffer import AudioBuffer
+from console import AsyncInput, TurnController
+from ingest import (
+    OPERATOR_PRIORITY,
+    Message,
+    MessageQueue,
+    SocketSource,
+    TailSource,
+    merge_messages,
+)
+from tts_cache import TTSCache
+from player import (
+    STREAM_FORMATS,
+    close_players,
+    negotiate_format,
+    play_stream,
+    set_audio_output,
+    stop_players,
+)
+from telemetry import telemetry
+from text_segment import segment_stream
+from tts_scheduler import TTSScheduler
 
+# httpx, NumPy and websockets are imported in run() once the arguments are
+# known, and only for the features that need them, to keep startup fast.
+# Only names used outside run() or never imported by it are listed here.
+if TYPE_CHECKING:
+    from audio_executor import AudioExecutor
+    from chat_client import ChatClient
+    from lipsync import LipSync
 
-async def run():
-    load_dotenv()
+
+async def play_audio(
+    buffer: AudioBuffer, lipsync: "LipSync | None", fmt: str = config.TTS_FORMAT
+) -> None:
+    """Play one utterance while lip sync reads the same buffer."""
+    if not lipsync:
+        await play_stream(buffer.reader(), fmt=fmt)
+        return
+
+    async def analyze() -> None:
+        async for chunk in buffer.reader():
+            await lipsync.feed(chunk)
+
+    await lipsync.begin_utterance()
+    tasks = [
+        asyncio.ensure_future(play_stream(buffer.reader(), fmt=fmt)),
+        asyncio.ensure_future(analyze()),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await lipsync.end_utterance()
+
+
+async def _echo(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    async for token in tokens:
+        print(token, end="", flush=True)
+        yield token
+    print()
+
+
+async def play_segments(
+    scheduler: TTSScheduler,
+    producer: asyncio.Task,
+    lipsync: "LipSync | None",
+    ready: asyncio.Event | None = None,
+) -> None:
+    """Play segments from ``scheduler`` in order while ``producer`` feeds it.
+
+    ``ready`` is set once the first audio of the reply has arrived.
+    """
+    try:
+        async for segment in scheduler:
+            if ready and not ready.is_set():
+                await segment.buffer.wait_ready()
+                ready.set()
+            await play_audio(segment.buffer, lipsync, scheduler.fmt)
+        await producer
+        # ffplay does not report when the queued audio finishes; the lip-sync
+        # timeline knows, otherwise this is when the last chunk was written.
+        end = lipsync.scheduler.end_time if lipsync else 0.0
+        telemetry.mark("playback_end", max(end, time.monotonic()), first=False)
+    finally:
+        producer.cancel()
+        await scheduler.aclose()
+
+
+async def speak_streaming(
+    client: "ChatClient",
+    text: str,
+    voice: str,
+    lipsync: "LipSync | None",
+    fmt: str = config.TTS_FORMAT,
+    ready: asyncio.Event | None = None,
+) -> None:
+    """Stream the reply and speak it sentence by sentence.
+
+    Segments are cut from the token stream by a background task and handed
+    to a :class:`TTSScheduler`, so the first sentence is heard while the
+    model is still generating and later ones are synthesized ahead of time.
+    """
+    scheduler = TTSScheduler(client, voice=voice, fmt=fmt)
+    tokens = _echo(client.ask_stream(text))
+    producer = asyncio.create_task(scheduler.feed(segment_stream(tokens)))
+    await play_segments(scheduler, producer, lipsync, ready)
+
+
+async def speak(
+    client: "ChatClient",
+    reply: str,
+    voice: str,
+    lipsync: "LipSync | None",
+    fmt: str = config.TTS_FORMAT,
+    ready: asyncio.Event | None = None,
+) -> None:
+    """Speak a complete reply with concurrent per-segment synthesis."""
+    scheduler = TTSScheduler(client, voice=voice, fmt=fmt)
+    producer = asyncio.create_task(scheduler.speak(reply))
+    await play_segments(scheduler, producer, lipsync, ready)
+
+
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="GPT-TTS CLI")
     parser.add_argument(
         "--debug",
@@ -53,16 +168,91 @@ async def run():
         action="store_true",
         help="send RMS levels to VTube Studio during playback",
     )
+    parser.add_argument(
+        "--visemes",
+        action=argparse.BooleanOptionalAction,
+        default=config.VISEMES,
+        help="with --lipstream, also drive the mouth form from the voice spectrum",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=("process", "thread", "inline"),
+        default=config.AUDIO_EXECUTOR,
+        help="where lip-sync analysis and audio processing run",
+    )
+    parser.add_argument(
+        "--listen",
+        type=int,
+        default=config.INGEST_PORT,
+        metavar="PORT",
+        help="read viewer messages from this local TCP port",
+    )
+    parser.add_argument(
+        "--tail",
+        metavar="PATH",
+        help="read viewer messages appended to this JSONL file",
+    )
+    parser.add_argument(
+        "--fillers",
+        action=argparse.BooleanOptionalAction,
+        default=config.ENABLE_FILLERS,
+        help="play a short filler phrase while a slow reply is on its way",
+    )
+    parser.add_argument(
+        "--stream",
+        action=argparse.BooleanOptionalAction,
+        default=config.STREAM_CHAT,
+        help="stream the reply and speak it sentence by sentence",
+    )
+    parser.add_argument(
+        "--format",
+        choices=STREAM_FORMATS,
+        default=config.TTS_FORMAT,
+        help="TTS audio format (mp3 or aac for slow connections)",
+    )
+    parser.add_argument(
+        "--tts-cache",
+        action=argparse.BooleanOptionalAction,
+        default=config.ENABLE_TTS_CACHE,
+        help="cache synthesized audio on disk",
+    )
+    parser.add_argument(
+        "--warmup",
+        action=argparse.BooleanOptionalAction,
+        default=config.HTTP_WARMUP,
+        help="open API connections at startup",
+    )
+    parser.add_argument(
+        "--metrics",
+        action=argparse.BooleanOptionalAction,
+        default=config.METRICS_ENABLED,
+        help="write per-turn traces and Prometheus metrics",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=config.METRICS_PORT,
+        help="serve Prometheus metrics on this port (0 disables)",
+    )
     parser.add_argument(
         "--audio-device",
         default="CABLE Input",
         help="output device for ffplay (Windows only)",
     )
-    args = parser.parse_args()
+    return parser.parse_args()
+
+
+async def run():
+    args = parse_args()
+    from dotenv import load_dotenv
 
+    load_dotenv()
     if args.token:
         os.environ["OPENAI_API_KEY"] = args.token
         if args.save_token:
+            from dotenv import set_key
+            from pathlib import Path
+
             env_path = Path(".env")
             set_key(env_path, "OPENAI_API_KEY", args.token)
 
@@ -71,20 +261,60 @@ async def run():
         format="[%(asctime)s] %(levelname)s: %(message)s",
     )
     set_audio_output(args.audio_device)
+    fmt = negotiate_format(args.format)
+    # The audio executor (NumPy, multiprocessing) is only needed for lip
+    # sync, fillers and normalized PCM
+    executor: "AudioExecutor | None" = None
+    if (
+        args.vtube
+        or args.lipstream
+        or args.fillers
+        or (config.AUDIO_NORMALIZE and fmt == "pcm")
+    ):
+        from audio_executor import executor
+
+        executor.configure(args.executor)
+    if args.metrics:
+        telemetry.enable()
+        telemetry.watch_loop()
+        if args.metrics_port:
+            await telemetry.serve(port=args.metrics_port)
+
+    from chat_client import ChatClient
 
+    tts_cache = TTSCache() if args.tts_cache else None
     try:
         client = ChatClient(
             api_key=args.token,
             debug=args.debug,
             system_prompt=args.system,
+            tts_cache=tts_cache,
         )
     except RuntimeError as e:
         print(e)
         return
+    if args.warmup:
+        await client.warmup()
+    client.start_keepalive()
 
-    vtube: VTubeClient | None = None
-    if args.vtube:
-        vtube = VTubeClient()
+    # One authenticated VTS connection shared by both lip-sync paths
+    vts: "VTSConnection | None" = None
+    if args.vtube or args.lipstream:
+        from lipsync import LipSync
+        from vtube import VTubeClient
+        from vtube_stream import VTubeStreamer
+        from vts_connection import VTSConnection
+
+        vts = VTSConnection()
+        try:
+            await vts.connect()
+        except OSError:
+            logging.warning("VTube Studio not running, lip sync disabled")
+            vts = None
+
+    vtube: "VTubeClient | None" = None
+    if args.vtube and vts:
+        vtube = VTubeClient(connection=vts)
         try:
             await vtube.connect()
             await vtube.check_connection()
@@ -94,51 +324,134 @@ async def run():
             )
             vtube = None
 
-    streamer: VTubeStreamer | None = None
-    if args.lipstream:
-        streamer = VTubeStreamer()
+    streamer: "VTubeStreamer | None" = None
+    if args.lipstream and vts:
+        streamer = VTubeStreamer(connection=vts, visemes=args.visemes, fmt=fmt)
         try:
             await streamer.connect()
         except ConnectionRefusedError:
             logging.warning("VTube Studio not running, live lip sync disabled")
             streamer = None
 
+    # The streamer drives its own parameter; otherwise the envelope is sent
+    # through the regular VTube client.
+    lipsync: "LipSync | None" = None
+    if streamer:
+        lipsync = streamer.lipsync
+    elif vtube:
+        lipsync = LipSync(vtube.send_level, fmt=fmt)
+
+    fillers: "FillerLibrary | None" = None
+    if args.fillers:
+        from fillers import FillerLibrary
+
+        fillers = FillerLibrary(client, voice=args.voice, fmt=fmt)
+        await fillers.load(lipsync)
+
     print(
-        "GPT-TTS CLI. \u0412\u0432\u0435\u0434\u0438\u0442\u0435 \u0437\u0430\u043f\u0440\u043e\u0441. \u0414\u043b\u044f \u0432\u044b\u0445\u043e\u0434\u0430: /exit, q"
+        "GPT-TTS CLI. \u0412\u0432\u0435\u0434\u0438\u0442\u0435 \u0437\u0430\u043f\u0440\u043e\u0441. \u0414\u043b\u044f \u0432\u044b\u0445\u043e\u0434\u0430: /exit, q. \u041f\u0440\u0435\u0440\u0432\u0430\u0442\u044c \u043e\u0442\u0432\u0435\u0442: /stop"
     )
-    while True:
-        try:
-            text = input("\u003e ").strip()
-        except (EOFError, KeyboardInterrupt):
-            break
-        if text.lower() in {"/exit", "q", "quit"}:
-            break
-        if not text:
-            continue
+    async def handle(text: str) -> None:
+        turn = telemetry.begin_turn()
+        # Set when the first audio of the reply is ready; a filler clip is
+        # played if that takes longer than the filler delay.
+        ready = asyncio.Event()
+        masking = (
+            asyncio.create_task(fillers.mask(ready, lipsync)) if fillers else None
+        )
         try:
+            if args.stream:
+                await speak_streaming(client, text, args.voice, lipsync, fmt, ready)
+                return
             reply = await client.ask(text)
             print(reply)
-            tts_stream = await client.tts(reply, voice=args.voice, fmt="mp3")
-            audio_buf = io.BytesIO()
-            async for chunk in tts_stream:
-                audio_buf.write(chunk)
-                if streamer:
-                    await streamer.send_rms(chunk)
-            audio_buf.seek(0)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                tmp.write(audio_buf.read())
-                tmp_path = tmp.name
-            play_file(tmp_path)
-            os.remove(tmp_path)
+            await speak(client, reply, args.voice, lipsync, fmt, ready)
         except Exception as e:
             logging.error("%s", e)
-    print("\u0414\u043e \u0441\u0432\u0438\u0434\u0430\u043d\u0438\u044f!")
-    await client.close()
-    if vtube:
-        await vtube.close()
-    if streamer:
-        await streamer.close()
+        finally:
+            if masking:
+                masking.cancel()
+            telemetry.end_turn(turn)
+
+    async def stop_audio() -> None:
+        await stop_players()
+        if lipsync:
+            lipsync.stop()
+
+    # Prompts wait in one queue. Viewer messages (--listen, --tail) are
+    # answered in turn, several at once if they piled up during a reply.
+    queue = MessageQueue()
+    sources: list[SocketSource | TailSource] = []
+    if args.listen:
+        sources.append(SocketSource(args.listen))
+    if args.tail:
+        sources.append(TailSource(args.tail))
+    readers = [asyncio.create_task(source.run(queue.put)) for source in sources]
+    turns = TurnController(on_stop=stop_audio)
+
+    async def dispatch() -> None:
+        while batch := await queue.get_batch():
+            text = merge_messages(batch)
+            if batch[0].source != "console":
+                print(text)
+            turns.start(handle(text))
+            await turns.wait()
+
+    dispatcher = asyncio.create_task(dispatch())
+
+    # Input is read in a thread so a new prompt can be typed while the
+    # reply is playing; a new prompt or /stop interrupts it.
+    console = AsyncInput("\u003e ")
+    try:
+        while True:
+            line = await console.readline()
+            if line is None:
+                # Without other sources, finish what is queued and exit
+                if not sources:
+                    queue.close()
+                await dispatcher
+                break
+            text = line.strip()
+            if text.lower() in {"/exit", "q", "quit"}:
+                break
+            if text.lower() == "/stop":
+                await turns.cancel()
+                continue
+            if not text:
+                continue
+            if turns.busy:
+                await turns.cancel()
+            queue.put(
+                Message(text, priority=OPERATOR_PRIORITY, source="console", merge=False)
+            )
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        # Ctrl+C: shut down the same way as /exit
+        pass
+    finally:
+        for task in (dispatcher, *readers):
+            task.cancel()
+        await turns.cancel()
+        print("\u0414\u043e \u0441\u0432\u0438\u0434\u0430\u043d\u0438\u044f!")
+        await close_players()
+        logging.debug("Connection stats: %s", client.connection_stats)
+        await client.close()
+        if tts_cache:
+            logging.debug("TTS cache stats: %s", tts_cache.stats)
+        if lipsync and not streamer:
+            await lipsync.close()
+        if vtube:
+            await vtube.close()
+        if streamer:
+            await streamer.close()
+        if vts:
+            await vts.close()
+        if executor:
+            executor.close()
+        await telemetry.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(run())
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import websockets
+
+SAMPLE_RATE = 48000
+
+
+def synth_audio(seconds: float, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Return s16le mono PCM of a syllable-like modulated tone."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    sig = np.sin(2 * np.pi * 220 * t) * envelope * 0.6
+    return (sig * 32767).astype(np.int16).tobytes()
+
+
+class MockOpenAI:
+    """Minimal HTTP/1.1 server for ``/chat/completions`` and ``/audio/speech``.
+
+    Args:
+        ttft: Delay before the first chat token (seconds).
+        token_interval: Delay between streamed tokens.
+        reply: Text returned by the chat endpoint, streamed word by word.
+        tts_latency: Delay before the first audio byte.
+        chunk_size: Size of the audio chunks.
+        chunk_interval: Delay between audio chunks.
+        seconds_per_char: Length of the synthesized audio per input char.
+        status: HTTP status of every API response; an error status such as
+            503 simulates an outage (can be changed while serving).
+    """
+
+    def __init__(
+        self,
+        ttft: float = 0.3,
+        token_interval: float = 0.02,
+        reply: str = (
+            "Sure, here is a short answer. It has a few sentences, so the "
+            "pipeline can start speaking early. This is the last one."
+        ),
+        tts_latency: float = 0.2,
+        chunk_size: int = 8192,
+        chunk_interval: float = 0.005,
+        seconds_per_char: float = 0.06,
+        status: int = 200,
+    ) -> None:
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.reply = reply
+        self.tts_latency = tts_latency
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self.seconds_per_char = seconds_per_char
+        self.status = status
+        self.requests = 0
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and return the base URL (``.../v1``)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/v1"
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *lines = head.decode("latin-1").rstrip().split("\r\n")
+                method, path, _ = request_line.split(" ", 2)
+                headers = {}
+                for line in lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                self.requests += 1
+                if self.status != 200 and path.endswith(("/chat/completions", "/audio/speech")):
+                    writer.write(
+                        b"HTTP/1.1 %d Error\r\nContent-Length: 2\r\n\r\n{}" % self.status
+                    )
+                elif path.endswith("/chat/completions"):
+                    await self._chat(writer, body)
+                elif path.endswith("/audio/speech"):
+                    await self._speech(writer, body)
+                else:
+                    self._send(writer, b'{"data": []}', "application/json")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _send(self, writer, body: bytes, content_type: str) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n"
+            % (content_type.encode(), len(body))
+        )
+        writer.write(body)
+
+    async def _chunk(self, writer, data: bytes) -> None:
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+
+    async def _chat(self, writer, body: dict) -> None:
+        await asyncio.sleep(self.ttft)
+        if not body.get("stream"):
+            data = {
+                "choices": [{"message": {"role": "assistant", "content": self.reply}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 10},
+            }
+            self._send(writer, json.dumps(data).encode(), "application/json")
+            return
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            token = word if i == 0 else " " + word
+            event = {"choices": [{"delta": {"content": token}}]}
+            await self._chunk(writer, f"data: {json.dumps(event)}\n\n".encode())
+            await asyncio.sleep(self.token_interval)
+        await self._chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    async def _speech(self, writer, body: dict) -> None:
+        await asyncio.sleep(self.tts_latency)
+        audio = synth_audio(len(body.get("input", "")) * self.seconds_per_char)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        for pos in range(0, len(audio), self.chunk_size):
+            await self._chunk(writer, audio[pos : pos + self.chunk_size])
+            await asyncio.sleep(self.chunk_interval)
+        writer.write(b"0\r\n\r\n")
+
+
+class MockVTS:
+    """VTube Studio API stand-in that records parameter injections.
+
+    Authentication always succeeds. Every ``InjectParameterDataRequest`` is
+    timestamped so the frame rate and jitter of lip sync can be measured.
+    """
+
+    def __init__(self, reply: bool = True) -> None:
+        self.reply = reply
+        self.injections: list[tuple[float, list[dict]]] = []
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await websockets.serve(self._handle, host, port)
+        port = next(iter(self._server.sockets)).getsockname()[1]
+        return f"ws://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, ws) -> None:
+        try:
+            await self._serve(ws)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _serve(self, ws) -> None:
+        async for raw in ws:
+            msg = json.loads(raw)
+            kind = msg.get("messageType")
+            data: dict = {}
+            if kind == "AuthenticationTokenRequest":
+                data = {"authenticationToken": "mock-token"}
+            elif kind == "AuthenticationRequest":
+                data = {"authenticated": True}
+            elif kind == "InjectParameterDataRequest":
+                self.injections.append(
+                    (time.monotonic(), msg["data"]["parameterValues"])
+                )
+            if self.reply:
+                await ws.send(json.dumps({
+                    "apiName": "VTubeStudioPublicAPI",
+                    "apiVersion": "1.0",
+                    "requestID": msg.get("requestID"),
+                    "messageType": f"{kind}Response",
+                    "data": data,
+                }))
+
+    def frame_stats(self, since: float = 0.0) -> dict[str, float]:
+        """Rate and inter-frame jitter of injections after ``since``."""
+        times = np.array([t for t, _ in self.injections if t >= since])
+        if len(times) < 2:
+            return {"frames": float(len(times)), "fps": 0.0, "jitter_ms": 0.0}
+        gaps = np.diff(times)
+        return {
+            "frames": float(len(times)),
+            "fps": float((len(times) - 1) / (times[-1] - times[0])),
+            "jitter_ms": float(np.std(gaps) * 1000),
+        }
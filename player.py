@@ -3,16 +3,21 @@ import subprocess
 import tempfile
 import os
 import logging
+import time
 from typing import AsyncIterator
 
-try:
-    from playsound import playsound
-except Exception:  # pragma: no cover - optional dependency
-    playsound = None
+from audio_decode import input_args
+from telemetry import telemetry
+
 
 
 FFPLAY_PATH = os.path.join("ffmpeg", "bin", "ffplay.exe")
 
+# Formats that stay playable when several replies are written one after
+# another into the stdin of one ffplay process. Container formats (wav,
+# ogg/opus, flac) start with a header that ffplay only reads once.
+STREAM_FORMATS = ("pcm", "mp3", "aac")
+
 # Output device name for routing audio through VB-CABLE.
 # Can be changed at runtime via :func:`set_audio_output`.
 AUDIO_OUT = "CABLE Input"
@@ -46,6 +51,11 @@ def _play_file_ffplay(path: str) -> bool:
 
 def _play_file_playsound(path: str) -> bool:
     """Play file using playsound if available."""
+    # Imported on first use: it is only the fallback when ffplay is missing
+    try:
+        from playsound import playsound
+    except Exception:  # pragma: no cover - optional dependency
+        playsound = None
     if playsound is None:
         return False
     try:
@@ -67,21 +77,157 @@ def play_file(path: str) -> None:
     logging.error("Не удалось воспроизвести звук: ffplay и playsound недоступны")
 
 
-async def play_stream(stream_iter: AsyncIterator[bytes]) -> None:
-    """Play an audio stream.
+class AudioPlayer:
+    """Long-lived ffplay process that plays audio fed through its stdin.
 
-    The iterator must yield raw bytes of an MP3 file. The data is saved to a
-    temporary ``.mp3`` file which is then played using ``ffplay`` located at
-    :data:`FFPLAY_PATH`. After playback the file is removed.
+    The process is started on the first chunk and kept alive between
+    utterances, so consecutive replies are played back to back without a
+    process spawn or a temporary file. Chunks are written as they arrive and
+    playback starts as soon as ffplay has enough data to decode a frame.
+    """
+
+    def __init__(self, fmt: str = "mp3") -> None:
+        self.fmt = fmt
+        self._proc: asyncio.subprocess.Process | None = None
+        self._device: str | None = None
+        self._lock = asyncio.Lock()
+        self.started_at: float = 0.0
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(FFPLAY_PATH)
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def start(self) -> None:
+        """Spawn ffplay reading from stdin if it is not running yet."""
+        if self.running and self._device == AUDIO_OUT:
+            return
+        await self.close()
+        logging.info("Аудио выводится в устройство: %s", AUDIO_OUT)
+        self._proc = await asyncio.create_subprocess_exec(
+            FFPLAY_PATH, "-nodisp", "-autoexit", "-loglevel", "quiet",
+            "-fflags", "nobuffer", "-probesize", "32",
+            "-audio_device", AUDIO_OUT,
+            *input_args(self.fmt), "-i", "pipe:0",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self._device = AUDIO_OUT
+
+    async def play(self, stream_iter: AsyncIterator[bytes]) -> bool:
+        """Feed an audio stream to the player.
+
+        Returns once all chunks have been handed to ffplay; the audio keeps
+        playing in the background. Returns False if ffplay is unavailable
+        or the process died.
+        """
+        async with self._lock:
+            first = True
+            async for chunk in stream_iter:
+                if first:
+                    await self.start()
+                    self.started_at = time.monotonic()
+                    telemetry.mark("playback_start", self.started_at)
+                    first = False
+                telemetry.inc("playback_bytes_total", len(chunk))
+                try:
+                    self._proc.stdin.write(chunk)
+                    await self._proc.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError) as e:
+                    logging.warning("ffplay pipe closed: %s", e)
+                    await self.stop()
+                    return False
+            return True
+
+    async def stop(self) -> None:
+        """Stop playback immediately, dropping buffered audio."""
+        if self._proc is None:
+            return
+        if self._proc.returncode is None:
+            self._proc.kill()
+        await self._proc.wait()
+        self._proc = None
+
+    async def close(self) -> None:
+        """Let buffered audio finish playing and end the process."""
+        if self._proc is None:
+            return
+        if self._proc.returncode is None:
+            try:
+                self._proc.stdin.close()
+                await self._proc.wait()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        self._proc = None
+
+
+_players: dict[str, AudioPlayer] = {}
+
+
+def negotiate_format(fmt: str) -> str:
+    """Return ``fmt`` if it can be played here, otherwise ``"mp3"``.
+
+    Raw PCM can only be streamed into ffplay; the ``playsound`` fallback
+    needs a file format.
     """
+    if fmt == "pcm" and not os.path.exists(FFPLAY_PATH):
+        logging.warning("ffplay not found, requesting mp3 instead of pcm")
+        return "mp3"
+    return fmt
 
+
+def get_player(fmt: str = "mp3") -> AudioPlayer:
+    """Return the shared :class:`AudioPlayer` for ``fmt``."""
+    player = _players.get(fmt)
+    if player is None:
+        player = _players[fmt] = AudioPlayer(fmt)
+    return player
+
+
+async def stop_players() -> None:
+    """Stop all shared players immediately (barge-in)."""
+    for player in _players.values():
+        await player.stop()
+
+
+async def close_players() -> None:
+    """Close all shared players, waiting for queued audio to finish."""
+    for player in _players.values():
+        await player.close()
+    _players.clear()
+
+
+async def _play_stream_tempfile(stream_iter: AsyncIterator[bytes], fmt: str) -> None:
     tmp_path = ""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{fmt}") as tmp:
             async for chunk in stream_iter:
                 tmp.write(chunk)
             tmp_path = tmp.name
-        play_file(tmp_path)
+        telemetry.mark("playback_start")
+        await asyncio.to_thread(play_file, tmp_path)
+        telemetry.mark("playback_end", first=False)
     finally:
         if tmp_path and os.path.exists(tmp_path):
             os.remove(tmp_path)
+
+
+async def play_stream(stream_iter: AsyncIterator[bytes], fmt: str = "mp3") -> None:
+    """Play an audio stream.
+
+    Chunks are piped into the shared long-lived ffplay process as they
+    arrive, so playback starts with the first chunk. If ffplay is not
+    available the data is saved to a temporary file and played with
+    ``playsound`` instead.
+    """
+    player = get_player(fmt)
+    if player.available:
+        if await player.play(stream_iter):
+            return
+        logging.warning("Streaming playback failed, rest of the utterance lost")
+        return
+    await _play_stream_tempfile(stream_iter, fmt)
@@ -0,0 +1,293 @@
+import asyncio
+import email.utils
+import logging
+import random
+import re
+import time
+from collections import deque
+from typing import Awaitable, Callable, Mapping, TypeVar
+
+import httpx
+
+import config
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the upstream is down."""
+
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str) -> float | None:
+    """Parse OpenAI reset values such as ``"1s"``, ``"6m0s"``, ``"20ms"``."""
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _UNITS[u] for n, u in parts)
+
+
+def _server_delay(headers: Mapping[str, str]) -> float | None:
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            date = None
+        if date is not None:
+            return date.timestamp() - time.time()
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if value:
+            return _parse_duration(value)
+    return None
+
+
+def parse_retry_after(
+    headers: Mapping[str, str], cap: float = config.RETRY_MAX_DELAY
+) -> float | None:
+    """Return how long the server asked us to wait, if it did.
+
+    The delay is limited to ``cap``, so a far-future date cannot stall a
+    turn. None if no header could be read.
+    """
+    delay = _server_delay(headers)
+    if delay is None:
+        return None
+    return min(float(cap), max(0.0, delay))
+
+
+class DecorrelatedJitter:
+    """Backoff delays ``min(cap, uniform(base, previous * 3))``.
+
+    Spreads concurrent retries apart instead of retrying in lockstep.
+    """
+
+    def __init__(
+        self,
+        base: float = config.RETRY_BASE_DELAY,
+        cap: float = config.RETRY_MAX_DELAY,
+    ) -> None:
+        self.base = base
+        self.cap = cap
+        self._delay = base
+
+    def next(self) -> float:
+        self._delay = min(self.cap, random.uniform(self.base, self._delay * 3))
+        return self._delay
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Hold all callers for ``seconds`` (e.g. after a 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        # Refilling starts when the pause ends, so held callers do not all
+        # get a token at once
+        self._updated = self._paused_until
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Open after ``failures`` consecutive errors, probe after ``reset`` s.
+
+    While half-open a single request is let through as the probe; until it
+    reports back (or ``reset`` s pass without an answer) the circuit counts
+    as open for everyone else.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failures: int = config.CIRCUIT_FAILURES,
+        reset: float = config.CIRCUIT_RESET,
+    ) -> None:
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self._count = 0
+        self._opened_at: float | None = None
+        self._probe_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        now = time.monotonic()
+        if now - self._opened_at < self.reset:
+            return "open"
+        if self._probe_at is not None and now - self._probe_at < self.reset:
+            # The probe is still in flight
+            return "open"
+        return "half-open"
+
+    def check(self) -> None:
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError(f"{self.name} upstream unavailable, circuit open")
+        if state == "half-open":
+            self._probe_at = time.monotonic()
+
+    def record_success(self) -> None:
+        self._count = 0
+        self._opened_at = None
+        self._probe_at = None
+
+    def record_failure(self) -> None:
+        self._count += 1
+        probing = self._probe_at is not None
+        if probing or self._count >= self.failures:
+            if self._opened_at is None or probing:
+                logging.warning("%s circuit opened for %ss", self.name, self.reset)
+            self._opened_at = time.monotonic()
+            self._probe_at = None
+
+
+class EndpointPolicy:
+    """Rate limiter, circuit breaker and latency history of one endpoint.
+
+    Also keeps exponentially weighted averages of the latency and of the
+    error rate, combined by :meth:`score` to rank endpoints that serve the
+    same requests. Errors are forgotten with ``ROUTE_ERROR_HALFLIFE``, so a
+    failed endpoint is tried again later.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_limit: tuple[float, int],
+        hedge_percentile: float | None = None,
+        min_samples: int = 20,
+    ) -> None:
+        self.name = name
+        self.limiter = TokenBucket(*rate_limit)
+        self.breaker = CircuitBreaker(name)
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.latencies: deque[float] = deque(maxlen=200)
+        self.retries = 0
+        self.ewma_latency: float | None = None
+        self._error = 0.0
+        self._error_at = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        age = time.monotonic() - self._error_at
+        return self._error * 0.5 ** (age / config.ROUTE_ERROR_HALFLIFE)
+
+    def _update_error(self, failed: bool) -> None:
+        alpha = config.ROUTE_EWMA_ALPHA
+        self._error = (1 - alpha) * self.error_rate + (alpha if failed else 0.0)
+        self._error_at = time.monotonic()
+
+    def score(self) -> float:
+        """Expected cost of a request in seconds; lower is better.
+
+        An endpoint without measurements scores 0, so it gets tried.
+        """
+        latency = self.ewma_latency or 0.0
+        return latency + config.ROUTE_ERROR_PENALTY * self.error_rate
+
+    def record_error(self) -> None:
+        self._update_error(True)
+
+    def record_success(self, elapsed: float, headers: Mapping[str, str]) -> None:
+        self.breaker.record_success()
+        self.latencies.append(elapsed)
+        if self.ewma_latency is None:
+            self.ewma_latency = elapsed
+        else:
+            self.ewma_latency += config.ROUTE_EWMA_ALPHA * (elapsed - self.ewma_latency)
+        self._update_error(False)
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            wait = _parse_duration(headers.get("x-ratelimit-reset-requests", ""))
+            if wait:
+                logging.debug("%s rate limit exhausted, pausing %.2fs", self.name, wait)
+                self.limiter.pause(wait)
+
+    def hedge_delay(self) -> float | None:
+        if self.hedge_percentile is None or len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    async def hedged(self, factory: Callable[[], Awaitable[T]]) -> T:
+        """Run ``factory``; start a second copy if the first is slow.
+
+        The first successful result wins and the other attempt is cancelled.
+        Responses of a losing attempt that already finished are closed.
+        """
+        delay = self.hedge_delay()
+        first = asyncio.ensure_future(factory())
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        logging.debug("%s slower than %.2fs, hedging", self.name, delay)
+        second = asyncio.ensure_future(factory())
+        pending = {first, second}
+        winner: asyncio.Future | None = None
+        error: BaseException | None = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    result = task.result()
+                    if isinstance(result, httpx.Response):
+                        await result.aclose()
@@ -0,0 +1,140 @@
+import logging
+import os
+from dataclasses import dataclass
+
+import config
+import http_pool
+from retry import EndpointPolicy
+
+# Kinds of requests routed independently
+KINDS = ("chat", "speech")
+
+
+@dataclass
+class Provider:
+    """An OpenAI-compatible API (an entry of ``config.PROVIDERS``)."""
+
+    name: str
+    base_url: str
+    api_key: str
+    text_model: str = config.TEXT_MODEL
+    voice_model: str = config.VOICE_MODEL
+    kinds: tuple[str, ...] = KINDS
+
+
+def load_providers(
+    api_key: str | None = None, entries: list[dict] | None = None
+) -> list[Provider]:
+    """Providers from ``config.PROVIDERS``, or ``BASE_URL`` if none are set.
+
+    ``api_key`` (e.g. from ``--token``) is used for entries whose key
+    variable is not set.
+    """
+    entries = config.PROVIDERS if entries is None else entries
+    if not entries:
+        key = api_key or os.environ.get("OPENAI_API_KEY")
+        if not key:
+            raise RuntimeError("OPENAI_API_KEY environment variable is not set")
+        return [Provider("default", config.BASE_URL, key)]
+    providers = []
+    for i, entry in enumerate(entries):
+        entry = dict(entry)
+        entry.setdefault("name", f"provider{i + 1}")
+        key_env = entry.pop("key_env", "OPENAI_API_KEY")
+        key = entry.pop("api_key", None) or os.environ.get(key_env) or api_key
+        if not key:
+            logging.warning("Provider %s skipped: %s is not set", entry["name"], key_env)
+            continue
+        entry["kinds"] = tuple(entry.get("kinds", KINDS))
+        providers.append(Provider(api_key=key, **entry))
+    if not providers:
+        raise RuntimeError("OPENAI_API_KEY environment variable is not set")
+    return providers
+
+
+class Upstream:
+    """Connection pool and per-kind request policies of one provider."""
+
+    def __init__(
+        self,
+        provider: Provider,
+        metrics: http_pool.ConnectionMetrics | None = None,
+        http2: bool = False,
+    ) -> None:
+        self.provider = provider
+        self.name = provider.name
+        self.client = http_pool.create_client(
+            {"Authorization": f"Bearer {provider.api_key}"},
+            metrics,
+            http2=http2,
+            base_url=provider.base_url,
+        )
+        self.policies = {}
+        if "chat" in provider.kinds:
+            self.policies["chat"] = EndpointPolicy(
+                f"{self.name}/chat", config.RATE_LIMIT_CHAT
+            )
+        if "speech" in provider.kinds:
+            self.policies["speech"] = EndpointPolicy(
+                f"{self.name}/speech",
+                config.RATE_LIMIT_SPEECH,
+                hedge_percentile=(
+                    config.TTS_HEDGE_PERCENTILE if config.TTS_HEDGE else None
+                ),
+            )
+
+    def __repr__(self) -> str:
+        return f"Upstream({self.name!r})"
+
+
+class Router:
+    """Ranks upstreams per kind of request by their measured score.
+
+    See :meth:`EndpointPolicy.score`. Upstreams with an open circuit come
+    last; ties keep the configured order, so with equal scores the first
+    provider is preferred.
+    """
+
+    def __init__(self, upstreams: list[Upstream]) -> None:
+        self.upstreams = upstreams
+
+    def ranked(self, kind: str) -> list[Upstream]:
+        routes = [u for u in self.upstreams if kind in u.policies]
+        if not routes:
+            raise RuntimeError(f"No provider configured for {kind} requests")
+        return sorted(
+            routes,
+            key=lambda u: (
+                u.policies[kind].breaker.state == "open",
+                u.policies[kind].score(),
+            ),
+        )
+
+    def pick(self, kind: str, tried: set[Upstream] = frozenset()) -> Upstream:
+        """Best upstream for ``kind``, preferring ones not in ``tried``."""
+        ranked = self.ranked(kind)
+        for upstream in ranked:
+            if upstream not in tried and upstream.policies[kind].breaker.state != "open":
+                return upstream
+        return ranked[0]
+
+    def has_fallback(self, kind: str, tried: set[Upstream]) -> bool:
+        """Whether an untried upstream with a closed circuit is left."""
+        return any(
+            u not in tried and u.policies[kind].breaker.state != "open"
+            for u in self.ranked(kind)
+        )
+
+    @property
+    def stats(self) -> dict[str, dict[str, dict[str, float | str | None]]]:
+        return {
+            u.name: {
+                kind: {
+                    "latency": policy.ewma_latency,
+                    "error_rate": round(policy.error_rate, 3),
+                    "circuit": policy.breaker.state,
+                }
+                for kind, policy in u.policies.items()
+            }
+            for u in self.upstreams
+        }
@@ -0,0 +1,500 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+import websockets
+from dotenv import load_dotenv
+
+import config
+from audio_executor import executor
+from chat_client import ChatClient
+from telemetry import telemetry
+from text_segment import segment_stream
+from tts_cache import TTSCache
+from tts_scheduler import TTSScheduler, TTSSegment
+
+# Request bodies are small JSON documents
+MAX_BODY = 64 * 1024
+# Seconds to wait for the "stopped" message of a cancelled WebSocket reply
+WS_STOP_TIMEOUT = 1.0
+
+CONTENT_TYPES = {
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+    "flac": "audio/flac",
+    "wav": "audio/wav",
+    "pcm": "audio/L16; rate=24000; channels=1",
+}
+
+
+class Session:
+    """One conversation: its own history, shared connections."""
+
+    def __init__(self, sid: str, client: ChatClient, concurrency: int) -> None:
+        self.id = sid
+        self.client = client
+        self.lock = asyncio.Semaphore(concurrency)
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+        self.requests += 1
+
+
+class SessionManager:
+    """Create sessions on demand and evict idle or excess ones.
+
+    Every session is a :meth:`ChatClient.fork` of one base client, so all of
+    them share a single connection pool, TTS cache and rate limiter. At most
+    ``max_sessions`` are kept (least recently used ones are dropped first)
+    and sessions idle for ``idle_timeout`` seconds are evicted.
+    """
+
+    def __init__(
+        self,
+        base: ChatClient,
+        system_prompt: str | None = config.SYSTEM_PROMPT,
+        max_sessions: int = config.SERVER_MAX_SESSIONS,
+        idle_timeout: float = config.SERVER_SESSION_IDLE,
+        concurrency: int = config.SERVER_SESSION_CONCURRENCY,
+    ) -> None:
+        self.base = base
+        self.system_prompt = system_prompt
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.concurrency = concurrency
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._evictor: asyncio.Task | None = None
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, sid: str) -> Session:
+        session = self._sessions.get(sid)
+        if session is None:
+            session = Session(
+                sid, self.base.fork(self.system_prompt), self.concurrency
+            )
+            self._sessions[sid] = session
+            logging.debug("Session %s created", sid)
+            while len(self._sessions) > self.max_sessions:
+                _, old = self._sessions.popitem(last=False)
+                self._discard(old)
+        self._sessions.move_to_end(sid)
+        session.touch()
+        return session
+
+    def _discard(self, session: Session) -> None:
+        self.evicted += 1
+        logging.debug("Session %s evicted", session.id)
+        asyncio.create_task(session.client.close())
+
+    def drop(self, sid: str) -> bool:
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return False
+        self._discard(session)
+        return True
+
+    def start(self) -> None:
+        self._evictor = asyncio.create_task(self._evict_idle())
+
+    async def _evict_idle(self) -> None:
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            deadline = time.monotonic() - self.idle_timeout
+            # Sessions are in LRU order, so stop at the first recent one.
+            while self._sessions:
+                sid, session = next(iter(self._sessions.items()))
+                if session.last_used > deadline:
+                    break
+                del self._sessions[sid]
+                self._discard(session)
+
+    async def close(self) -> None:
+        if self._evictor is not None:
+            self._evictor.cancel()
+        for session in self._sessions.values():
+            await session.client.close()
+        self._sessions.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "evicted": self.evicted,
+            "connections": self.base.connection_stats,
+            "routes": self.base.router.stats,
+            "tts_cache": self.base.tts_cache.stats if self.base.tts_cache else None,
+        }
+
+
+async def speak_reply(
+    client: ChatClient,
+    text: str,
+    voice: str,
+    fmt: str,
+    tokens: list[str] | None = None,
+) -> AsyncIterator[TTSSegment]:
+    """Stream a reply and yield its synthesized segments in order.
+
+    Reply tokens are appended to ``tokens`` as they arrive.
+    """
+
+    async def collect() -> AsyncIterator[str]:
+        async for token in client.ask_stream(text):
+            if tokens is not None:
+                tokens.append(token)
+            yield token
+
+    scheduler = TTSScheduler(client, voice=voice, fmt=fmt)
+    producer = asyncio.create_task(scheduler.feed(segment_stream(collect())))
+    try:
+        async for segment in scheduler:
+            yield segment
+        await producer
+    finally:
+        producer.cancel()
+        await scheduler.aclose()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway",
+}
+
+
+class Server:
+    """HTTP and WebSocket front end over a :class:`SessionManager`.
+
+    HTTP (one request per connection):
+
+    - ``POST /sessions/<id>/ask`` ``{"text"}`` -> ``{"reply"}``
+    - ``POST /sessions/<id>/tts`` ``{"text", "voice"?, "format"?}`` -> audio
+    - ``POST /sessions/<id>/speak`` ``{"text", ...}`` -> audio of the reply,
+      streamed segment by segment while the model is still generating
+    - ``DELETE /sessions/<id>``
+    - ``GET /stats``
+    - ``GET /metrics`` (Prometheus text format, with ``--metrics``)
+
+    WebSocket ``/sessions/<id>``: send ``{"type": "ask", "text": ...}``;
+    the server answers with ``token`` messages, a ``segment`` message
+    followed by binary audio frames for every sentence, and ``done`` with
+    the full reply. ``{"type": "stop"}`` cancels the current reply.
+    """
+
+    def __init__(self, sessions: SessionManager, voice: str = config.DEFAULT_VOICE) -> None:
+        self.sessions = sessions
+        self.voice = voice
+
+    # -- HTTP ---------------------------------------------------------------
+
+    async def handle_http(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, *lines = head.decode("latin-1").rstrip().split("\r\n")
+            method, target, _ = request_line.split(" ", 2)
+            headers = {}
+            for line in lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                raise HTTPError(413, "request body too large")
+            body = await reader.readexactly(length) if length else b""
+            await self._dispatch(method, urlsplit(target).path, body, writer)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.exception("HTTP handler error")
+            try:
+                await self._send_json(writer, 500, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _dispatch(
+        self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter
+    ) -> None:
+        parts = [p for p in path.split("/") if p]
+        if parts == ["stats"] and method == "GET":
+            return await self._send_json(writer, 200, self.sessions.stats)
+        if parts == ["metrics"] and method == "GET":
+            body = telemetry.prometheus().encode()
+            await self._send_head(
+                writer,
+                200,
+                {
+                    "Content-Type": "text/plain; version=0.0.4",
+                    "Content-Length": str(len(body)),
+                },
+            )
+            writer.write(body)
+            return await writer.drain()
+        if len(parts) < 2 or parts[0] != "sessions":
+            raise HTTPError(404, "not found")
+        sid = parts[1]
+        if len(parts) == 2:
+            if method != "DELETE":
+                raise HTTPError(405, "method not allowed")
+            found = self.sessions.drop(sid)
+            return await self._send_json(writer, 200 if found else 404, {"deleted": found})
+        if len(parts) != 3:
+            raise HTTPError(404, "not found")
+        if method != "POST":
+            raise HTTPError(405, "method not allowed")
+        try:
+            req = json.loads(body or b"{}")
+            text = req["text"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, 'expected JSON body with "text"')
+        voice = req.get("voice", self.voice)
+        fmt = req.get("format", "mp3")
+        if fmt not in CONTENT_TYPES:
+            raise HTTPError(400, f"unsupported format {fmt}")
+
+        session = self.sessions.get(sid)
+        turn = telemetry.begin_turn(parts[2])
+        try:
+            async with session.lock:
+                return await self._session_request(
+                    session.client, parts[2], text, voice, fmt, writer
+                )
+        finally:
+            telemetry.end_turn(turn)
+
+    async def _session_request(
+        self,
+        client: ChatClient,
+        action: str,
+        text: str,
+        voice: str,
+        fmt: str,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        if action == "ask":
+            reply = await client.ask(text)
+            return await self._send_json(writer, 200, {"reply": reply})
+        if action == "tts":
+            audio = await client.tts(text, voice=voice, fmt=fmt)
+            return await self._send_stream(writer, CONTENT_TYPES[fmt], audio)
+        if action == "speak":
+
+            async def chunks() -> AsyncIterator[bytes]:
+                async for segment in speak_reply(client, text, voice, fmt):
+                    async for chunk in segment.aiter_bytes():
+                        yield chunk
+
+            return await self._send_stream(writer, CONTENT_TYPES[fmt], chunks())
+        raise HTTPError(404, "not found")
+
+    async def _send_head(
+        self, writer: asyncio.StreamWriter, status: int, headers: dict[str, str]
+    ) -> None:
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, obj) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode()
+        await self._send_head(
+            writer,
+            status,
+            {"Content-Type": "application/json", "Content-Length": str(len(body))},
+        )
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_stream(
+        self,
+        writer: asyncio.StreamWriter,
+        content_type: str,
+        chunks: AsyncIterator[bytes],
+    ) -> None:
+        """Send ``chunks`` with chunked transfer encoding as they arrive."""
+        await self._send_head(
+            writer,
+            200,
+            {"Content-Type": content_type, "Transfer-Encoding": "chunked"},
+        )
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception:
+            # The 200 head is already out, so an error response would end up
+            # inside the body. Dropping the connection without the final
+            # chunk tells the client the response is incomplete.
+            logging.exception("HTTP stream failed")
+            writer.transport.abort()
+            return
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # -- WebSocket ----------------------------------------------------------
+
+    async def handle_ws(self, ws) -> None:
+        parts = [p for p in urlsplit(ws.request.path).path.split("/") if p]
+        if len(parts) != 2 or parts[0] != "sessions":
+            await ws.close(1008, "expected /sessions/<id>")
+            return
+        sid = parts[1]
+        tasks: set[asyncio.Task] = set()
+        try:
+            async for raw in ws:
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    await ws.send(json.dumps({"type": "error", "message": "bad JSON"}))
+                    continue
+                if msg.get("type") == "stop":
+                    for task in tasks:
+                        task.cancel()
+                elif msg.get("type") == "ask" and msg.get("text"):
+                    task = asyncio.create_task(self._ws_ask(ws, sid, msg))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _ws_ask(self, ws, sid: str, msg: dict) -> None:
+        session = self.sessions.get(sid)
+        voice = msg.get("voice", self.voice)
+        fmt = msg.get("format", "mp3")
+        tokens: list[str] = []
+        sent = 0
+        turn = telemetry.begin_turn("ws")
+        try:
+            async with session.lock:
+                async for segment in speak_reply(
+                    session.client, msg["text"], voice, fmt, tokens
+                ):
+                    sent = await self._ws_tokens(ws, tokens, sent)
+                    if msg.get("audio", True):
+                        await ws.send(json.dumps({
+                            "type": "segment",
+                            "index": segment.index,
+                            "text": segment.text,
+                            "format": fmt,
+                        }))
+                        async for chunk in segment.aiter_bytes():
+                            await ws.send(chunk)
+            await self._ws_tokens(ws, tokens, sent)
+            await ws.send(json.dumps({"type": "done", "reply": "".join(tokens).strip()}))
+        except asyncio.CancelledError:
+            # Best effort: a slow or closed socket must not hold up or hide
+            # the cancellation
+            try:
+                await asyncio.wait_for(
+                    ws.send(json.dumps({"type": "stopped"})), WS_STOP_TIMEOUT
+                )
+            except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                pass
+            raise
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as e:
+            logging.error("Session %s: %s", sid, e)
+            await ws.send(json.dumps({"type": "error", "message": str(e)}))
+        finally:
+            telemetry.end_turn(turn)
+
+    async def _ws_tokens(self, ws, tokens: list[str], sent: int) -> int:
+        if len(tokens) > sent:
+            await ws.send(json.dumps({"type": "token", "text": "".join(tokens[sent:])}))
+        return len(tokens)
+
+
+async def serve() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="GPT-TTS multi-session server")
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--http-port", type=int, default=config.SERVER_HTTP_PORT)
+    parser.add_argument("--ws-port", type=int, default=config.SERVER_WS_PORT)
+    parser.add_argument("--token", help="OpenAI API key")
+    parser.add_argument("--system", default=config.SYSTEM_PROMPT, help="system prompt")
+    parser.add_argument("--voice", default=config.DEFAULT_VOICE, help="default TTS voice")
+    parser.add_argument(
+        "--tts-cache",
+        action=argparse.BooleanOptionalAction,
+        default=config.ENABLE_TTS_CACHE,
+        help="cache synthesized audio on disk",
+    )
+    parser.add_argument(
+        "--metrics",
+        action=argparse.BooleanOptionalAction,
+        default=config.METRICS_ENABLED,
+        help="record per-request traces and serve GET /metrics",
+    )
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+    if args.metrics:
+        telemetry.enable()
+        telemetry.watch_loop()
+    try:
+        base = ChatClient(
+            api_key=args.token,
+            debug=args.debug,
+            system_prompt=args.system,
+            tts_cache=TTSCache() if args.tts_cache else None,
+        )
+    except RuntimeError as e:
+        print(e)
+        return
+    base.start_keepalive()
+    sessions = SessionManager(base, system_prompt=args.system)
+    sessions.start()
+    server = Server(sessions, voice=args.voice)
+    http = await asyncio.start_server(server.handle_http, args.host, args.http_port)
+    ws = await websockets.serve(server.handle_ws, args.host, args.ws_port)
+    logging.info(
+        "Serving HTTP on %s:%s, WebSocket on %s:%s",
+        args.host, args.http_port, args.host, args.ws_port,
+    )
+    try:
+        await asyncio.Future()
+    finally:
+        http.close()
+        ws.close()
+        await sessions.close()
+        await base.close()
+        executor.close()
+        await telemetry.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
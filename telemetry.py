@@ -0,0 +1,319 @@
+import asyncio
+import bisect
+import contextvars
+import itertools
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+import config
+
+PREFIX = "gpt_tts_"
+
+# Latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict[str, str]) -> LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative buckets for export plus a rolling window for percentiles."""
+
+    def __init__(self, window: int = 500) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Turn:
+    """Timeline of one conversational turn.
+
+    :meth:`mark` records when each stage is reached, relative to the start
+    of the turn: the first occurrence by default, the latest one with
+    ``first=False`` (e.g. the end of the last segment).
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind: str = "turn") -> None:
+        self.id = next(self._ids)
+        self.kind = kind
+        self.wall = time.time()
+        self.start = time.monotonic()
+        self.marks: dict[str, float] = {}
+        self.spans: list[tuple[str, float, float]] = []
+
+    def mark(self, name: str, at: float | None = None, first: bool = True) -> None:
+        if first and name in self.marks:
+            return
+        at = time.monotonic() if at is None else at
+        self.marks[name] = at - self.start
+
+
+_current_turn: contextvars.ContextVar[Turn | None] = contextvars.ContextVar(
+    "current_turn", default=None
+)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Metrics:
+    """Counters, gauges, latency histograms and per-turn traces.
+
+    Disabled by default: every recording method returns immediately, so the
+    instrumentation left in the hot paths costs one attribute check. When
+    enabled, finished turns are appended to a JSONL trace file and all
+    metrics can be rendered in the Prometheus text format, written to a file
+    or served over HTTP.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.trace_path: str | None = None
+        self.prom_path: str | None = None
+        self.counters: dict[LabelKey, float] = {}
+        self.gauges: dict[LabelKey, float] = {}
+        self.histograms: dict[LabelKey, Histogram] = {}
+        self._trace = None
+        self._server: asyncio.AbstractServer | None = None
+        self._lag_task: asyncio.Task | None = None
+
+    def enable(
+        self,
+        trace_path: str | None = config.METRICS_TRACE_FILE,
+        prom_path: str | None = config.METRICS_PROM_FILE,
+    ) -> None:
+        self.enabled = True
+        self.trace_path = trace_path
+        self.prom_path = prom_path
+        if trace_path:
+            self._trace = open(trace_path, "a", encoding="utf-8")
+
+    # -- recording ------------------------------------------------------------
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge, e.g. a queue depth."""
+        if not self.enabled:
+            return
+        self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def mark(self, name: str, at: float | None = None, first: bool = True) -> None:
+        """Mark a stage of the current turn, see :meth:`Turn.mark`."""
+        if not self.enabled:
+            return
+        turn = _current_turn.get()
+        if turn is not None:
+            turn.mark(name, at, first)
+
+    @contextmanager
+    def _span(self, name: str, labels: dict) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            self.observe(f"{name}_seconds", end - start, **labels)
+            turn = _current_turn.get()
+            if turn is not None:
+                turn.spans.append((name, start - turn.start, end - start))
+
+    def span(self, name: str, **labels):
+        """Context manager timing a stage into ``<name>_seconds``."""
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, labels)
+
+    def begin_turn(self, kind: str = "turn") -> contextvars.Token | None:
+        """Start a turn in the current context.
+
+        Tasks created afterwards inherit it, so marks from the chat, TTS
+        and playback tasks end up on the same timeline.
+        """
+        if not self.enabled:
+            return None
+        return _current_turn.set(Turn(kind))
+
+    def end_turn(self, token: contextvars.Token | None) -> None:
+        if token is None:
+            return
+        turn = _current_turn.get()
+        _current_turn.reset(token)
+        if turn is None:
+            return
+        total = time.monotonic() - turn.start
+        self.observe("turn_seconds", total, kind=turn.kind)
+        for stage, offset in turn.marks.items():
+            self.observe("turn_stage_seconds", offset, stage=stage)
+        if self._trace is not None:
+            record = {
+                "turn": turn.id,
+                "kind": turn.kind,
+                "time": turn.wall,
+                "duration": round(total, 4),
+                "marks": {k: round(v, 4) for k, v in turn.marks.items()},
+                "spans": [
+                    {"name": n, "start": round(s, 4), "duration": round(d, 4)}
+                    for n, s, d in turn.spans
+                ],
+            }
+            self._trace.write(json.dumps(record) + "\n")
+            self._trace.flush()
+        if self.prom_path:
+            self.write_prometheus(self.prom_path)
+
+    # -- export ---------------------------------------------------------------
+
+    def prometheus(self) -> str:
+        lines: list[str] = []
+        typed: set[str] = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_fmt_labels(labels)} {value:g}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} gauge")
+                typed.add(metric)
+            lines.append(f"{metric}{_fmt_labels(labels)} {value:g}")
+        for (name, labels), hist in sorted(self.histograms.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), hist.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{metric}_bucket{_fmt_labels(labels, le)} {cumulative}")
+            lines.append(f"{metric}_sum{_fmt_labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{metric}_count{_fmt_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """p50/p95 of the rolling window of every histogram."""
+        out = {}
+        for (name, labels), hist in self.histograms.items():
+            key = name + _fmt_labels(labels)
+            out[key] = {
+                "p50": hist.percentile(0.5),
+                "p95": hist.percentile(0.95),
+                "count": hist.count,
+            }
+        return out
+
+    async def serve(self, host: str = "127.0.0.1", port: int = config.METRICS_PORT) -> None:
+        """Serve the Prometheus text format on ``http://host:port/metrics``."""
+
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.prometheus().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    b"Content-Length: %d\r\nConnection: close\r\n\r\n%s"
+                    % (len(body), body)
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        self._server = await asyncio.start_server(handle, host, port)
+        logging.info("Metrics on http://%s:%s/metrics", host, port)
+
+    def watch_loop(self, interval: float = config.LOOP_LAG_INTERVAL) -> None:
+        """Record how late the event loop wakes up (``event_loop_lag_seconds``).
+
+        Anything that blocks the loop, such as audio analysis or a slow
+        callback, shows up as lag and delays websocket sends and HTTP reads.
+        """
+        if self.enabled and self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._watch_loop(interval))
+
+    async def _watch_loop(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.observe("event_loop_lag_seconds", lag)
+            if lag > 0.1:
+                logging.debug("Event loop blocked for %.0f ms", lag * 1000)
+
+    async def close(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self.prom_path and self.enabled:
+            self.write_prometheus(self.prom_path)
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+telemetry = Metrics()
@@ -0,0 +1,91 @@
+import re
+from typing import AsyncIterator
+
+import config
+
+# Sentence terminators, optionally followed by closing quotes/brackets.
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»”)\]]*(?=\s)")
+# Softer clause boundaries used to cut long sentences or the first segment.
+_CLAUSE_END = re.compile(r"[,;:—–]+(?=\s)")
+
+
+class SentenceSplitter:
+    """Incrementally cut a token stream into speakable segments.
+
+    Tokens are fed as they arrive from the model. Whenever the buffer
+    contains a complete sentence it is returned, so TTS can start before the
+    reply is finished. The first segment is also cut at clause boundaries
+    (commas, dashes) to reduce time-to-first-audio.
+    """
+
+    def __init__(
+        self,
+        min_chars: int = config.SEGMENT_MIN_CHARS,
+        max_chars: int = config.SEGMENT_MAX_CHARS,
+        first_clause_chars: int = config.SEGMENT_FIRST_CLAUSE_CHARS,
+    ) -> None:
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.first_clause_chars = first_clause_chars
+        self._buf = ""
+        self._emitted = 0
+
+    def _cut(self, pattern: re.Pattern[str], min_len: int) -> int:
+        for m in pattern.finditer(self._buf):
+            if m.end() >= min_len:
+                return m.end()
+        return -1
+
+    def feed(self, text: str) -> list[str]:
+        """Add text and return the segments completed by it."""
+        self._buf += text
+        out: list[str] = []
+        while True:
+            pos = self._cut(_SENTENCE_END, self.min_chars)
+            if pos < 0 and self._emitted == 0:
+                pos = self._cut(_CLAUSE_END, self.first_clause_chars)
+            if pos < 0 and len(self._buf) >= self.max_chars:
+                pos = self._cut(_CLAUSE_END, self.min_chars)
+                if pos < 0:
+                    pos = self._buf.rfind(" ", 0, self.max_chars)
+                    pos = pos if pos > 0 else self.max_chars
+            if pos < 0:
+                break
+            segment = self._buf[:pos].strip()
+            self._buf = self._buf[pos:].lstrip()
+            if segment:
+                out.append(segment)
+                self._emitted += 1
+        return out
+
+    def flush(self) -> str | None:
+        """Return whatever is left in the buffer."""
+        segment = self._buf.strip()
+        self._buf = ""
+        if not segment:
+            return None
+        self._emitted += 1
+        return segment
+
+
+def split_segments(text: str, **kwargs) -> list[str]:
+    """Split a complete text into segments using :class:`SentenceSplitter`."""
+    splitter = SentenceSplitter(**kwargs)
+    segments = splitter.feed(text)
+    tail = splitter.flush()
+    if tail:
+        segments.append(tail)
+    return segments
+
+
+async def segment_stream(
+    tokens: AsyncIterator[str], **kwargs
+) -> AsyncIterator[str]:
+    """Yield segments from an async iterator of text deltas."""
+    splitter = SentenceSplitter(**kwargs)
+    async for token in tokens:
+        for segment in splitter.feed(token):
+            yield segment
+    tail = splitter.flush()
+    if tail:
+        yield tail
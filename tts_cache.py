@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator
+
+import config
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache lookups (Unicode NFC, collapsed spaces)."""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TTSCache:
+    """Content-addressed on-disk cache of synthesized audio.
+
+    Entries are stored as ``<sha256>.<fmt>`` files in ``path``; the key
+    covers the normalized text, voice, voice model and format. The index
+    (key -> size, in LRU order) is kept in memory and rebuilt from the
+    directory at startup, using file mtimes as the recency. When the total
+    size exceeds ``max_bytes`` the least recently used entries are removed.
+    """
+
+    def __init__(
+        self,
+        path: str = config.TTS_CACHE_DIR,
+        max_bytes: int = config.TTS_CACHE_MAX_MB * 1024 * 1024,
+        chunk_size: int = 16384,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Left by a write that was interrupted before the rename
+                self._remove(entry.path)
+                continue
+            st = entry.stat()
+            if not st.st_size:
+                # Never committed by tee(); not a usable entry
+                self._remove(entry.path)
+                continue
+            entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total += size
+        logging.debug(
+            "TTS cache: %d entries, %.1f MB", len(self._index), self._total / 2**20
+        )
+        self._evict()
+
+    @staticmethod
+    def key(text: str, voice: str, model: str, fmt: str) -> str:
+        raw = "\0".join((normalize_text(text), voice, model, fmt))
+        return f"{hashlib.sha256(raw.encode()).hexdigest()}.{fmt}"
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def get(self, key: str) -> str | None:
+        """Return the file path of a cached entry and mark it as recent."""
+        if key not in self._index:
+            self.misses += 1
+            return None
+        path = self._file(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        self.hits += 1
+        return path
+
+    async def stream(self, path: str) -> AsyncIterator[bytes]:
+        """Yield the content of a cached file from a memory map."""
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                # An empty file cannot be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for pos in range(0, len(mm), self.chunk_size):
+                    yield mm[pos : pos + self.chunk_size]
+
+    async def tee(self, key: str, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass ``stream`` through while storing it under ``key``.
+
+        The entry is only committed when the stream is read to the end.
+        """
+        tmp = f"{self._file(key)}.{uuid.uuid4().hex}.tmp"
+        size = 0
+        complete = False
+        try:
+            with open(tmp, "wb") as f:
+                async for chunk in stream:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = size > 0
+        finally:
+            if complete:
+                try:
+                    os.replace(tmp, self._file(key))
+                    self._add(key, size)
+                except OSError as e:
+                    # On Windows an entry that is being read cannot be
+                    # replaced; the audio was still delivered
+                    logging.debug("TTS cache: could not store %s: %s", key, e)
+                    complete = False
+            if not complete:
+                self._remove(tmp)
+
+    def _add(self, key: str, size: int) -> None:
+        self._total += size - self._index.pop(key, 0)
+        self._index[key] = size
+        self._evict()
+
+    def _drop(self, key: str) -> None:
+        self._total -= self._index.pop(key, 0)
+        self._remove(self._file(key))
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        """Delete a file, skipping it if it is gone or still in use.
+
+        On Windows a file that is memory mapped by :meth:`stream` cannot be
+        removed; it is left behind and evicted again after the next start.
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.debug("TTS cache: could not remove %s: %s", path, e)
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and len(self._index) > 1:
+            key = next(iter(self._index))
+            self._drop(key)
+            self.evictions += 1
+
+    @property
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": self._total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
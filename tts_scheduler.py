@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from functools import partial
+from typing import TYPE_CHECKING, AsyncIterator, Callable
+
+import config
+from audio_buffer import AudioBuffer, BufferReader
+from telemetry import telemetry
+from text_segment import split_segments
+
+if TYPE_CHECKING:
+    from chat_client import ChatClient
+
+
+@dataclass
+class TTSSegment:
+    """Audio of one text segment, filled while it is synthesized."""
+
+    index: int
+    text: str
+    buffer: AudioBuffer = field(default_factory=AudioBuffer)
+
+    @property
+    def size(self) -> int:
+        return self.buffer.size
+
+    def aiter_bytes(self) -> BufferReader:
+        """Read the audio from the start; waits for chunks still to come."""
+        return self.buffer.reader()
+
+
+class TTSScheduler:
+    """Synthesize segments concurrently and hand them out in order.
+
+    Up to ``concurrency`` TTS requests run at once on the client's shared
+    connection pool. Segments are handed out as soon as their request is
+    scheduled and their audio can be read while it downloads. At most
+    ``prefetch`` segments are queued ahead of the consumer: :meth:`submit`
+    waits when the window is full, which keeps memory bounded on very long
+    replies.
+
+    With ``normalize``, "pcm" audio goes through an :class:`AudioProcessor`
+    on its way into the segment buffer: silence at both ends is trimmed
+    and all segments are brought to the same loudness.
+    """
+
+    def __init__(
+        self,
+        client: "ChatClient",
+        voice: str = config.DEFAULT_VOICE,
+        fmt: str = "mp3",
+        concurrency: int = config.TTS_CONCURRENCY,
+        prefetch: int = config.TTS_PREFETCH,
+        normalize: bool = config.AUDIO_NORMALIZE,
+    ) -> None:
+        self.client = client
+        self.voice = voice
+        self.fmt = fmt
+        self._processor: Callable[[], "AudioProcessor"] | None = None
+        if normalize and fmt == "pcm":
+            # Imported here so that NumPy is only loaded when needed
+            from audio_executor import executor
+            from audio_process import AudioProcessor, RunningLoudness
+
+            self._executor = executor
+            self._processor = partial(AudioProcessor, loudness=RunningLoudness())
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._queue: asyncio.Queue[TTSSegment | None] = asyncio.Queue(
+            maxsize=max(1, prefetch)
+        )
+        self._pending: set[asyncio.Task] = set()
+        self._count = 0
+        self._closed = False
+
+    async def _synthesize(self, segment: TTSSegment) -> None:
+        buffer = segment.buffer
+        processor = self._processor() if self._processor else None
+        first = True
+        try:
+            async with self._sem:
+                start = time.monotonic()
+                telemetry.mark("tts_request")
+                stream = await self.client.tts(
+                    segment.text, voice=self.voice, fmt=self.fmt
+                )
+                async with aclosing(stream):
+                    async for chunk in stream:
+                        if first:
+                            first = False
+                            telemetry.observe(
+                                "tts_first_byte_seconds", time.monotonic() - start
+                            )
+                            telemetry.mark("tts_first_byte")
+                        if processor:
+                            chunk = await self._executor.run(processor.process, chunk)
+                        await buffer.append(chunk)
+                if processor:
+                    await buffer.append(processor.flush())
+        except asyncio.CancelledError:
+            buffer.close()
+            raise
+        except Exception as e:
+            # Raised to whoever reads the segment
+            buffer.close(e)
+            return
+        buffer.close()
+        telemetry.observe("tts_segment_seconds", time.monotonic() - start)
+        telemetry.inc("tts_bytes_total", segment.size)
+        telemetry.inc("tts_segments_total")
+        if processor:
+            telemetry.inc(
+                "silence_trimmed_seconds_total",
+                processor.trimmed / processor.sample_rate,
+            )
+        telemetry.mark("tts_complete", first=False)
+        logging.debug("TTS segment %d ready (%d bytes)", segment.index, segment.size)
+
+    async def submit(self, text: str) -> None:
+        """Schedule ``text`` for synthesis, waiting while the window is full."""
+        if self._closed:
+            raise RuntimeError("TTSScheduler is closed")
+        segment = TTSSegment(self._count, text)
+        self._count += 1
+        task = asyncio.create_task(self._synthesize(segment))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        try:
+            await self._queue.put(segment)
+        except BaseException:
+            task.cancel()
+            raise
+
+    async def finish(self) -> None:
+        """Mark the end of input; iteration stops after the last segment."""
+        if not self._closed:
+            self._closed = True
+            await self._queue.put(None)
+
+    async def speak(self, text: str) -> None:
+        """Split ``text`` into segments and submit them all."""
+        try:
+            for segment in split_segments(text):
+                await self.submit(segment)
+        finally:
+            await self.finish()
+
+    async def feed(self, segments: AsyncIterator[str]) -> None:
+        """Submit segments from an async iterator (e.g. a streamed reply)."""
+        try:
+            async for segment in segments:
+                await self.submit(segment)
+        finally:
+            await self.finish()
+
+    async def __aiter__(self) -> AsyncIterator[TTSSegment]:
+        while (segment := await self._queue.get()) is not None:
+            yield segment
+
+    async def aclose(self) -> None:
+        """Cancel outstanding synthesis requests."""
+        for task in list(self._pending):
+            task.cancel()
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        while not self._queue.empty():
+            self._queue.get_nowait()
@@ -0,0 +1,111 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import config
+from audio_decode import SAMPLE_RATE
+
+# Frequency bands (Hz) for the band energy ratios
+BANDS = ((0, 500), (500, 2000), (2000, 6000))
+# Spectral centroid range mapped to the mouth form: rounded ("oo") at the
+# low end, wide ("ee") at the high end
+FORM_CENTROID = (400.0, 3200.0)
+# Frames quieter than this are treated as silence
+VOICED_RMS = 0.01
+
+
+class VisemeEngine:
+    """Map s16le mono PCM to several mouth parameters per frame.
+
+    Every ``frame_ms`` frame is analysed with a windowed FFT over the last
+    ``n_fft`` samples; all frames of a block go through one batched
+    ``rfft``. From the spectrum come the RMS energy, the spectral centroid
+    and the energy ratios of :data:`BANDS`, which are mapped to:
+
+    - column 0, mouth open: energy times ``gain``, lowered for hissing
+      sounds whose energy is mostly above 2 kHz;
+    - column 1, mouth form: the centroid on a log scale between
+      :data:`FORM_CENTROID`, ``rest`` during silence.
+
+    :meth:`process` keeps the tail of the previous block, so feeding an
+    utterance in pieces gives the same frames as :meth:`analyze` on the
+    whole of it.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        frame_ms: int = config.LIPSYNC_FRAME_MS,
+        gain: float = 1.0,
+        rest: float = 0.5,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.gain = gain
+        self.hop = max(1, sample_rate * frame_ms // 1000)
+        self.n_fft = 1 << (2 * self.hop - 1).bit_length()
+        self.window = np.hanning(self.n_fft).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.n_fft, 1 / sample_rate).astype(np.float32)
+        self._freqs = freqs
+        self._bands = np.stack(
+            [(freqs >= lo) & (freqs < hi) for lo, hi in BANDS], axis=1
+        ).astype(np.float32)
+        self._log_range = np.log(FORM_CENTROID)
+        self.rest = np.array([0.0, rest], np.float32)
+        self._history = np.zeros(self.n_fft - self.hop, np.float32)
+
+    def reset(self) -> None:
+        """Forget the previous block (call at the start of an utterance)."""
+        self._history[:] = 0
+
+    def features(self, sig: np.ndarray) -> dict[str, np.ndarray]:
+        """Per-frame features of float samples (continuing the history)."""
+        n = len(sig) // self.hop
+        sig = sig[: n * self.hop]
+        buf = np.concatenate((self._history, sig))
+        self._history = buf[len(buf) - len(self._history):].copy()
+        frames = sliding_window_view(buf, self.n_fft)[:: self.hop][:n]
+        spec = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        total = spec.sum(axis=1) + 1e-12
+        hops = sig.reshape(n, self.hop)
+        return {
+            "energy": np.sqrt(np.mean(hops * hops, axis=1)),
+            "centroid": spec @ self._freqs / total,
+            "bands": spec @ self._bands / total[:, None],
+        }
+
+    def map(self, feats: dict[str, np.ndarray]) -> np.ndarray:
+        """Turn features into a ``(frames, 2)`` array of parameter values."""
+        energy = feats["energy"]
+        high = feats["bands"][:, 2]
+        mouth_open = np.clip(energy * self.gain * (1 - 0.5 * high), 0, 1)
+        lo, hi = self._log_range
+        form = np.clip((np.log(feats["centroid"] + 1) - lo) / (hi - lo), 0, 1)
+        form = np.where(energy > VOICED_RMS, form, self.rest[1])
+        return np.stack((mouth_open, form), axis=1).astype(np.float32)
+
+    def process(self, pcm: bytes | bytearray | memoryview) -> np.ndarray:
+        """Analyse whole frames of PCM; a partial frame is zero-padded."""
+        sig = np.frombuffer(pcm, np.int16).astype(np.float32) / 32768
+        if len(sig) % self.hop:
+            sig = np.pad(sig, (0, self.hop - len(sig) % self.hop))
+        if not len(sig):
+            return np.zeros((0, 2), np.float32)
+        return self.map(self.features(sig))
+
+    def analyze(self, pcm: bytes | bytearray | memoryview) -> np.ndarray:
+        """Frames of a complete utterance, e.g. to store next to its audio."""
+        self.reset()
+        return self.process(pcm)
+
+
+def analyze_pcm(
+    pcm: bytes | bytearray | memoryview | np.ndarray,
+    sample_rate: int = SAMPLE_RATE,
+    frame_ms: int = config.LIPSYNC_FRAME_MS,
+    gain: float = 1.0,
+) -> np.ndarray:
+    """Viseme frames of a complete utterance, for :class:`AudioExecutor`.
+
+    Every call gets its own engine: the engine keeps the tail of the last
+    block, and calls may run at the same time in the executor's threads.
+    """
+    return VisemeEngine(sample_rate, frame_ms, gain).analyze(pcm)
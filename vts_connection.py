@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Callable
+
+import websockets
+
+import config
+from retry import DecorrelatedJitter
+from vts_sender import ParameterSender
+
+ErrorHandler = Callable[[dict[str, Any]], None]
+
+
+class VTSConnection:
+    """Shared, authenticated connection to the VTube Studio API.
+
+    A background reader dispatches responses to waiting :meth:`request`
+    calls by ``requestID``; replies nobody waits for (e.g. to fire-and-forget
+    :meth:`inject` calls) are dropped, and ``APIError`` messages are passed
+    to the registered error handlers. The authentication token is stored in
+    ``token_path`` under the plugin name and developer, so several plugin
+    identities can share the file, and reused on the next start. If the
+    socket drops, the connection is re-established in the background with
+    jittered backoff.
+    """
+
+    def __init__(
+        self,
+        url: str = config.VTS_URL,
+        *,
+        plugin_name: str = "GPT-TTS",
+        plugin_developer: str = "You",
+        token_path: str | None = config.VTS_TOKEN_FILE,
+    ) -> None:
+        self.url = url
+        self.plugin_name = plugin_name
+        self.plugin_developer = plugin_developer
+        self.token_path = token_path
+        self._ws: websockets.ClientConnection | None = None
+        self._reader: asyncio.Task | None = None
+        self._reconnect: asyncio.Task | None = None
+        self._pending: dict[str, asyncio.Future] = {}
+        self._error_handlers: list[ErrorHandler] = []
+        self._closing = False
+        self.sender = ParameterSender(self)
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None
+
+    @property
+    def backlog(self) -> int:
+        """Bytes queued in the socket's write buffer."""
+        if self._ws is None:
+            return 0
+        return self._ws.transport.get_write_buffer_size()
+
+    def add_error_handler(self, handler: ErrorHandler) -> None:
+        self._error_handlers.append(handler)
+
+    def _message(self, message_type: str, data: dict | None, request_id: str) -> str:
+        msg = {
+            "apiName": "VTubeStudioPublicAPI",
+            "apiVersion": "1.0",
+            "requestID": request_id,
+            "messageType": message_type,
+        }
+        if data is not None:
+            msg["data"] = data
+        return json.dumps(msg)
+
+    @property
+    def _token_key(self) -> str:
+        return f"{self.plugin_name}/{self.plugin_developer}"
+
+    def _read_tokens(self) -> dict[str, str]:
+        if not self.token_path or not os.path.exists(self.token_path):
+            return {}
+        with open(self.token_path, encoding="utf-8") as f:
+            text = f.read().strip()
+        try:
+            tokens = json.loads(text)
+        except ValueError:
+            tokens = None
+        if not isinstance(tokens, dict):
+            # A single token saved by an older version, owner unknown
+            return {self._token_key: text} if text else {}
+        return tokens
+
+    def _load_token(self) -> str | None:
+        return self._read_tokens().get(self._token_key) or None
+
+    def _save_token(self, token: str) -> None:
+        if not self.token_path:
+            return
+        tokens = self._read_tokens()
+        tokens[self._token_key] = token
+        with open(self.token_path, "w", encoding="utf-8") as f:
+            json.dump(tokens, f, indent=2)
+
+    async def connect(self) -> None:
+        """Open the socket and authenticate.
+
+        Raises ``ConnectionRefusedError`` if VTube Studio is not running.
+        If authentication fails, the socket is closed again.
+        """
+        self._closing = False
+        ws = await websockets.connect(self.url, open_timeout=10)
+        self._ws = ws
+        self._reader = asyncio.create_task(self._read(ws))
+        logging.debug("VTube WS connected to %s", self.url)
+        try:
+            await self._authenticate()
+        except BaseException:
+            await self._drop()
+            raise
+
+    async def _authenticate(self) -> None:
+        plugin = {
+            "pluginName": self.plugin_name,
+            "pluginDeveloper": self.plugin_developer,
+        }
+        token = self._load_token()
+        if token:
+            resp = await self.request(
+                "AuthenticationRequest", {**plugin, "authenticationToken": token}
+            )
+            if resp.get("data", {}).get("authenticated"):
+                logging.info("VTS authenticated")
+                return
+            logging.info("Stored VTS token rejected, requesting a new one")
+        # The user has to confirm the plugin in VTube Studio, allow time for it.
+        resp = await self.request("AuthenticationTokenRequest", plugin, timeout=60)
+        token = resp.get("data", {}).get("authenticationToken")
+        if not token:
+            logging.warning("VTube WS token missing in response")
+            return
+        resp = await self.request(
+            "AuthenticationRequest", {**plugin, "authenticationToken": token}
+        )
+        if not resp.get("data", {}).get("authenticated"):
+            logging.warning("VTube WS authentication failed")
+            return
+        self._save_token(token)
+        logging.info("VTS authenticated")
+
+    async def _read(self, ws) -> None:
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                fut = self._pending.pop(msg.get("requestID"), None)
+                if fut is not None:
+                    if not fut.done():
+                        fut.set_result(msg)
+                    continue
+                if msg.get("messageType") == "APIError":
+                    logging.debug("VTS error: %s", msg.get("data"))
+                    for handler in self._error_handlers:
+                        handler(msg)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._on_disconnect(ws)
+
+    def _on_disconnect(self, ws) -> None:
+        if self._ws is not ws:
+            return
+        self._ws = None
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("VTube WS connection lost"))
+        self._pending.clear()
+        if self._closing:
+            return
+        if self._reconnect is not None and not self._reconnect.done():
+            # A reconnect that failed during authentication; its loop retries
+            return
+        logging.warning("VTube WS connection lost, reconnecting")
+        self._reconnect = asyncio.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self) -> None:
+        backoff = DecorrelatedJitter(base=0.5, cap=10)
+        while not self._closing:
+            await asyncio.sleep(backoff.next())
+            try:
+                await self.connect()
+                return
+            except (
+                OSError,
+                websockets.WebSocketException,
+                ConnectionError,
+                asyncio.TimeoutError,
+            ) as e:
+                logging.debug("VTube WS reconnect failed: %s", e)
+
+    async def request(
+        self, message_type: str, data: dict | None = None, timeout: float = 2
+    ) -> dict[str, Any]:
+        """Send a request and wait for the response with the same ID."""
+        if self._ws is None:
+            raise ConnectionError("VTube WS not connected")
+        request_id = str(uuid.uuid4())
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = fut
+        try:
+            await self._ws.send(self._message(message_type, data, request_id))
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def send(self, message_type: str, data: dict | None = None) -> bool:
+        """Send a request without waiting for the reply.
+
+        Returns False if the connection is down; the message is dropped.
+        """
+        if self._ws is None:
+            return False
+        try:
+            await self._ws.send(
+                self._message(message_type, data, str(uuid.uuid4()))
+            )
+            return True
+        except websockets.ConnectionClosed:
+            return False
+
+    async def send_raw(self, message: str) -> bool:
+        """Send a pre-rendered message without waiting for the reply."""
+        if self._ws is None:
+            return False
+        try:
+            await self._ws.send(message)
+            return True
+        except websockets.ConnectionClosed:
+            return False
+
+    async def inject(self, values: dict[str, float], mode: str = "set") -> bool:
+        """Set parameter values without waiting for VTube Studio's reply."""
+        return await self.send(
+            "InjectParameterDataRequest",
+            {
+                "mode": mode,
+                "parameterValues": [
+                    {"id": k, "value": v, "weight": 1.0} for k, v in values.items()
+                ],
+            },
+        )
+
+    async def ping(self, timeout: float = 1) -> bool:
+        if self._ws is None:
+            return False
+        try:
+            pong = await self._ws.ping()
+            await asyncio.wait_for(pong, timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _drop(self) -> None:
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            await ws.close()
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+    async def close(self) -> None:
+        self._closing = True
+        await self.sender.close()
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        await self._drop()
+        logging.debug("VTube WS closed")
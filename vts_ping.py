@@ -1,53 +1,34 @@
 import asyncio
-import json
-import uuid
-import websockets
+
+from vts_connection import VTSConnection
 
 WS_URL = "ws://127.0.0.1:8001"
 PARAM_ID = "MouthOpen"  # change this if you want another parameter
-PLUGIN = {"pluginName": "GPT-TTS test", "pluginDeveloper": "You"}
+PLUGIN = {"plugin_name": "GPT-TTS test", "plugin_developer": "You"}
 
-rid = lambda: str(uuid.uuid4())
 
 async def main():
-    async with websockets.connect(WS_URL) as ws:
-        # 1. AuthenticationTokenRequest
-        await ws.send(json.dumps({
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": rid(),
-            "messageType": "AuthenticationTokenRequest",
-            "data": PLUGIN,
-        }))
-        token = json.loads(await ws.recv())["data"]["authenticationToken"]
-
-        # 2. AuthenticationRequest
-        await ws.send(json.dumps({
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": rid(),
-            "messageType": "AuthenticationRequest",
-            "data": {**PLUGIN, "authenticationToken": token},
-        }))
-        print("Auth response:", await ws.recv())
+    conn = VTSConnection(WS_URL, **PLUGIN)
+    await conn.connect()
+    try:
+        print("Connected:", conn.connected)
 
-        # 3. Open and close the mouth three times
+        # Open and close the mouth three times
         for _ in range(3):
             for v in (1.0, 0.0):
-                await ws.send(json.dumps({
-                    "apiName": "VTubeStudioPublicAPI",
-                    "apiVersion": "1.0",
-                    "requestID": rid(),
-                    "messageType": "InjectParameterDataRequest",
-                    "data": {
+                resp = await conn.request(
+                    "InjectParameterDataRequest",
+                    {
                         "mode": "set",
                         "parameterValues": [
                             {"id": PARAM_ID, "value": v, "weight": 1.0},
                         ],
                     },
-                }))
-                print("Resp:", await ws.recv())
+                )
+                print("Resp:", resp)
                 await asyncio.sleep(0.4)
+    finally:
+        await conn.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
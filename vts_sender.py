@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+import config
+from telemetry import telemetry
+
+
+class ParameterSender:
+    """Rate-controlled, batched ``InjectParameterDataRequest`` sender.
+
+    :meth:`set` only records the latest values; a background task sends
+    them at most ``fps`` times per second, all parameters in one
+    ``parameterValues`` array. Updates that arrive before the next slot, or
+    while the socket still has ``max_backlog`` bytes queued, are coalesced
+    into the latest value. Changes below ``deadband`` are dropped, but the
+    values are refreshed every ``refresh`` seconds so VTube Studio does not
+    reset them.
+
+    Messages are rendered from a pre-built JSON template in which only the
+    request ID and the values are substituted.
+    """
+
+    def __init__(
+        self,
+        conn,
+        fps: float = config.VTS_MAX_FPS,
+        deadband: float = config.VTS_DEADBAND,
+        refresh: float = config.VTS_REFRESH,
+        max_backlog: int = config.VTS_MAX_BACKLOG,
+    ) -> None:
+        self.conn = conn
+        self.period = 1 / fps
+        self.deadband = deadband
+        self.refresh = refresh
+        self.max_backlog = max_backlog
+        self._values: dict[str, float] = {}
+        self._sent_values: dict[str, float] = {}
+        self._dirty = False
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._ids = itertools.count()
+        self._template_keys: tuple[str, ...] = ()
+        self._template = ""
+        self._last_send = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def set(self, values: dict[str, float]) -> None:
+        """Queue new parameter values; never blocks."""
+        if self._dirty:
+            self.coalesced += 1
+            telemetry.inc("vts_frames_total", result="coalesced")
+        self._values.update(values)
+        self._dirty = True
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _render(self, values: dict[str, float]) -> str:
+        keys = tuple(values)
+        if keys != self._template_keys:
+            params = ",".join(
+                '{"id":%s,"value":%%.4f,"weight":1}'
+                % json.dumps(k).replace("%", "%%")
+                for k in keys
+            )
+            self._template = (
+                '{"apiName":"VTubeStudioPublicAPI","apiVersion":"1.0",'
+                '"requestID":"lip%d","messageType":"InjectParameterDataRequest",'
+                '"data":{"mode":"set","parameterValues":[' + params + "]}}"
+            )
+            self._template_keys = keys
+        return self._template % (next(self._ids), *values.values())
+
+    def _changed(self, now: float) -> bool:
+        if now - self._last_send >= self.refresh:
+            return True
+        for key, value in self._values.items():
+            prev = self._sent_values.get(key)
+            if prev is None or abs(value - prev) >= self.deadband:
+                return True
+        return False
+
+    async def _run(self) -> None:
+        while True:
+            if not self._dirty:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.refresh)
+                except asyncio.TimeoutError:
+                    if not self._sent_values or not any(self._sent_values.values()):
+                        continue
+                    # Refresh held values so VTube Studio does not reset them.
+                    self._dirty = True
+            now = time.monotonic()
+            wait = self._last_send + self.period - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if self.conn.backlog > self.max_backlog:
+                telemetry.inc("vts_frames_total", result="backlog")
+                await asyncio.sleep(self.period)
+                continue
+            self._dirty = False
+            if not self._changed(now):
+                self.dropped += 1
+                telemetry.inc("vts_frames_total", result="dropped")
+                continue
+            values = dict(self._values)
+            if await self.conn.send_raw(self._render(values)):
+                self.sent += 1
+                telemetry.inc("vts_frames_total", result="sent")
+                if now - self._last_send < 1:
+                    telemetry.observe("vts_frame_interval_seconds", now - self._last_send)
+                self._sent_values = values
+                self._last_send = now
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"sent": self.sent, "dropped": self.dropped, "coalesced": self.coalesced}
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logging.debug("VTS sender stats: %s", self.stats)
@@ -1,94 +1,77 @@
 import asyncio
 import json
-import uuid
-import websockets
-import numpy as np
 import logging
-import subprocess
-import os
 
-rid = lambda: str(uuid.uuid4())
+import numpy as np
+
+import config
+from audio_decode import decoded_rate
+from lipsync import LipSync
+from visemes import VisemeEngine
+from vts_connection import VTSConnection
+
 
 class VTubeStreamer:
-    def __init__(self, url="ws://127.0.0.1:8001", param="MouthOpen",
-                 smoothing=0.25, gain=1.6):
+    def __init__(self, url=config.VTS_URL, param="MouthOpen",
+                 smoothing=0.25, gain=1.6, window_ms=20, fmt="mp3",
+                 connection: VTSConnection | None = None,
+                 visemes=config.VISEMES, form_param=config.VISEME_FORM_PARAM):
         self.url = url
         self.param = param
         self.smooth = smoothing
         self.gain = gain
-        self.ws = None
+        self.window_ms = window_ms
+        self.fmt = fmt
+        self._own_connection = connection is None
+        self.conn = connection
+        self.form_param = form_param
         self.value = 0.0
+        self._param_created = False
+        engine = None
+        if visemes:
+            engine = VisemeEngine(decoded_rate(fmt), frame_ms=window_ms, gain=gain)
+            self.values = engine.rest.copy()
+        self.lipsync = LipSync(self._send_level, fmt=fmt, gain=gain,
+                               frame_ms=window_ms, engine=engine)
 
-    async def connect(self, plugin="GPT-TTS", dev="CLI"):
-        self.ws = await websockets.connect(self.url, open_timeout=10)
-        await self.ws.send(json.dumps({
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": rid(),
-            "messageType": "AuthenticationTokenRequest",
-            "data": {"pluginName": plugin, "pluginDeveloper": dev},
-        }))
-        token = json.loads(await self.ws.recv())["data"]["authenticationToken"]
-        await self.ws.send(json.dumps({
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": rid(),
-            "messageType": "AuthenticationRequest",
-            "data": {
-                "pluginName": plugin,
-                "pluginDeveloper": dev,
-                "authenticationToken": token,
-            },
-        }))
-        await self.ws.recv()
-        logging.info("VTS authenticated")
+    async def connect(self, plugin="GPT-TTS", dev="You"):
+        if self.conn is None:
+            self.conn = VTSConnection(self.url, plugin_name=plugin,
+                                      plugin_developer=dev)
+        self.conn.add_error_handler(self._on_error)
+        if not self.conn.connected:
+            await self.conn.connect()
 
-    async def send_rms(self, mp3_bytes: bytes):
-        ffmpeg = os.path.join("ffmpeg", "bin", "ffmpeg.exe")
-        proc = await asyncio.create_subprocess_exec(
-            ffmpeg, "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", "48000", "pipe:1",
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
-        )
-        pcm, _ = await proc.communicate(mp3_bytes)
-        if not pcm:
+    async def _send_level(self, rms: float | np.ndarray):
+        if isinstance(rms, np.ndarray):
+            # Viseme row: mouth open and form, sent in one injection
+            self.values += self.smooth * (rms - self.values)
+            self.value = float(self.values[0])
+            self.conn.sender.set({
+                self.param: self.value,
+                self.form_param: float(self.values[1]),
+            })
             return
-        sig = np.frombuffer(pcm, np.int16).astype(np.float32)
-        rms = np.sqrt(np.mean(sig**2)) / 32768 * self.gain
-        rms = min(1.0, rms)
         self.value += self.smooth * (rms - self.value)
-        payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": rid(),
-            "messageType": "InjectParameterDataRequest",
-            "data": {
-                "mode": "set",
-                "parameterValues": [
-                    {"id": self.param, "value": self.value, "weight": 1.0}
-                ],
-            },
-        }
-        await self.ws.send(json.dumps(payload))
-        resp = await self.ws.recv()
+        self.conn.sender.set({self.param: self.value})
         logging.debug("raw_rms %.3f -> %.3f", rms, self.value)
-        logging.debug("VTS reply: %s", resp)
-        if "ParameterNotFound" in resp:
-            create = {
-                "apiName": "VTubeStudioPublicAPI",
-                "apiVersion": "1.0",
-                "requestID": rid(),
-                "messageType": "ParameterCreationRequest",
-                "data": {
-                    "name": self.param,
-                    "description": "GPT-TTS lip sync",
-                    "min": 0,
-                    "max": 1,
-                    "defaultValue": 0,
-                },
-            }
-            await self.ws.send(json.dumps(create))
-            logging.info("привяжите MouthOpen к ParamMouthOpenY")
+
+    def _on_error(self, msg):
+        if "ParameterNotFound" in json.dumps(msg) and not self._param_created:
+            self._param_created = True
+            asyncio.create_task(self._create_param())
+
+    async def _create_param(self):
+        await self.conn.send("ParameterCreationRequest", {
+            "name": self.param,
+            "description": "GPT-TTS lip sync",
+            "min": 0,
+            "max": 1,
+            "defaultValue": 0,
+        })
+        logging.info("привяжите MouthOpen к ParamMouthOpenY")
 
     async def close(self):
-        if self.ws:
-            await self.ws.close()
+        await self.lipsync.close()
+        if self.conn and self._own_connection:
+            await self.conn.close()